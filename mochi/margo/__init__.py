@@ -11,6 +11,8 @@ MargoInstance = core.Engine
 Engine = core.Engine
 Address = core.Address
 Handle = core.Handle
+RemoteException = core.RemoteException
+LRU = core.LRU
 
 remote = core.remote
 provider = core.provider
@@ -0,0 +1,206 @@
+# (C) 2022 The University of Chicago
+# See COPYRIGHT in top-level directory.
+
+"""
+Transport of NumPy arrays as RPC arguments, without copying their
+content into the request's payload. NumPy is only imported when
+arrays are actually created or received.
+"""
+
+import _pymargo
+from typing import Any, Optional, Tuple
+from .bulk import Bulk, BufferPool, current_mid, current_addr, \
+    read_only, write_only, pull, max_segments, _segment_count, _staged
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("RemoteArray requires NumPy") from e
+    return numpy
+
+
+class RemoteArray:
+    """
+    NumPy array passed as an argument of an RPC. Only its dtype and shape
+    travel in the request, along with a Bulk handle exposing its memory,
+    from which the receiver pulls the content when it accesses the array.
+    C and Fortran contiguous arrays are exposed as a single segment,
+    other arrays as one segment per contiguous block (in C order), so
+    that neither side makes a packing copy, unless this would take more
+    than bulk.max_segments segments, in which case a contiguous copy
+    is used.
+
+    On the sender's side, the array must be neither modified nor freed
+    until the RPC has completed:
+
+        rpc(RemoteArray(array))
+
+    On the receiver's side, the handler gets a RemoteArray whose content
+    is pulled on first access (see array and materialize). This must
+    happen before the handler responds, since the sender may then
+    release the memory.
+    """
+
+    def __init__(self, array: Any):
+        """
+        Constructor, for the sender's side.
+        array : numpy.ndarray, or any object numpy.asarray accepts.
+        """
+        numpy = _numpy()
+        array = numpy.asarray(array)
+        if array.dtype.hasobject:
+            raise TypeError("Cannot send arrays of Python objects")
+        self._array: Optional[Any] = array
+        self._dtype = array.dtype
+        self._shape: Tuple[int, ...] = array.shape
+        self._order = 'F' if array.flags.f_contiguous \
+            and not array.flags.c_contiguous else 'C'
+        self._bulk: Optional[Bulk] = None
+        self._staging: Any = None
+        self._mid = None
+        self._hg_addr = None
+        self._lease: Optional[Tuple[BufferPool, memoryview, Bulk]] = None
+
+    def __getstate__(self):
+        if self._bulk is None and self.nbytes > 0:
+            mid = current_mid.get()
+            if mid is None:
+                raise RuntimeError(
+                    "Could not serialize RemoteArray: no current_mid set")
+            # the transpose of a Fortran array is a C array,
+            # whose memory is exposed in the C order of the original
+            exposed = self._array.T if self._order == 'F' else self._array
+            # kept along with the Bulk when it is a copy
+            self._staging = _staged(exposed, read_only)
+            self._bulk = Bulk(_pymargo.bulk_create(
+                mid, self._staging, read_only))
+        return self._dtype, self._shape, self._order, self._bulk
+
+    def __setstate__(self, state):
+        self._dtype, self._shape, self._order, self._bulk = state
+        self._array = None
+        self._staging = None
+        self._lease = None
+        self._mid = current_mid.get()
+        hg_addr = current_addr.get()
+        if callable(hg_addr):
+            hg_addr = hg_addr()
+        # the address is duplicated since the RPC handle owning it
+        # may be destroyed before the array is materialized
+        self._hg_addr = None if hg_addr is None \
+            else _pymargo.addr_dup(self._mid, hg_addr)
+
+    def __del__(self) -> None:
+        """
+        Destructor. Returns the pooled buffer, if any,
+        and frees the address of the sender.
+        """
+        if getattr(self, '_lease', None) is not None:
+            self.release()
+        if getattr(self, '_hg_addr', None) is not None:
+            _pymargo.addr_free(self._mid, self._hg_addr)
+
+    @property
+    def dtype(self) -> Any:
+        return self._dtype
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def nbytes(self) -> int:
+        count = 1
+        for dim in self._shape:
+            count *= dim
+        return count * self._dtype.itemsize
+
+    @property
+    def array(self) -> Any:
+        """
+        The numpy.ndarray, pulled into newly allocated memory
+        on first access.
+        """
+        return self.materialize()
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> Any:
+        return _numpy().asarray(self.materialize(), dtype=dtype)
+
+    def materialize(self, out: Any = None,
+                    pool: Optional[BufferPool] = None) -> Any:
+        """
+        Pulls the content of the array, if not done yet, and returns it.
+        out : numpy.ndarray of the same shape and dtype to pull into,
+              which may have any layout.
+        pool : BufferPool from which to lease the memory of the array.
+               The buffer is returned to the pool by release (or when
+               the RemoteArray is deleted), which requires the returned
+               array (and the arrays derived from it) to be deleted first.
+        By default, the array is pulled into newly allocated memory.
+        """
+        numpy = _numpy()
+        if self._array is not None:
+            if out is None:
+                return self._array
+            out[...] = self._array
+            return out
+        if out is not None:
+            if out.shape != self._shape or out.dtype != self._dtype:
+                raise ValueError(
+                    f"Cannot pull an array of shape {self._shape} and dtype "
+                    f"{self._dtype} into one of shape {out.shape} and "
+                    f"dtype {out.dtype}")
+            if self.nbytes > 0:
+                self._pull(out.T if self._order == 'F' else out)
+            self._array = out
+        elif pool is not None and self.nbytes > 0:
+            view, bulk = pool.acquire(self.nbytes)
+            self._lease = (pool, view, bulk)
+            try:
+                self._transfer(bulk._hg_bulk)
+            except BaseException:
+                self.release()
+                raise
+            self._array = numpy.frombuffer(view, dtype=self._dtype).reshape(
+                self._shape, order=self._order)
+        else:
+            array = numpy.empty(self._shape, self._dtype, order=self._order)
+            if self.nbytes > 0:
+                self._pull(array.T if self._order == 'F' else array)
+            self._array = array
+        return self._array
+
+    def _pull(self, target: Any) -> None:
+        if _segment_count(target) > max_segments:
+            staging = _numpy().empty(target.shape, target.dtype)
+            self._pull(staging)
+            target[...] = staging
+            return
+        local_bulk = _pymargo.bulk_create(self._mid, target, write_only)
+        try:
+            self._transfer(local_bulk)
+        finally:
+            _pymargo.bulk_free(local_bulk)
+
+    def _transfer(self, local_bulk: Any) -> None:
+        if self._hg_addr is None:
+            raise RuntimeError(
+                "Could not pull RemoteArray: the address of its sender "
+                "is unknown (it must be received as an RPC argument)")
+        _pymargo.bulk_transfer(self._mid, pull, self._hg_addr,
+                               self._bulk._hg_bulk, 0,
+                               local_bulk, 0, self.nbytes)
+
+    def release(self) -> None:
+        """
+        Returns the buffer leased by materialize(pool=...) to its pool.
+        Raises BufferError if the array is still referenced elsewhere.
+        """
+        if self._lease is None:
+            return
+        pool, view, bulk = self._lease
+        self._array = None
+        pool.release(view, bulk)
+        self._lease = None
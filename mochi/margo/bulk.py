@@ -1,9 +1,20 @@
 import _pymargo
-from typing import TYPE_CHECKING, Optional
-from .typing import hg_bulk_t, margo_instance_id
+import bisect
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterator, \
+    List, Optional, Sequence, Tuple, Union
+from .typing import hg_addr_t, hg_bulk_t, margo_instance_id
+
+from .cache import LRU
 
 if TYPE_CHECKING:
-    from .core import Engine  # noqa: F401
+    from .core import Address, Engine  # noqa: F401
 
 """
 Tags to indicate what type of operations are expected from a Bulk handle.
@@ -18,6 +29,70 @@ Types of operations to perform on Bulk handles.
 push = _pymargo.xfer.push
 pull = _pymargo.xfer.pull
 
+"""
+Maximum number of segments of a Bulk handle. Engine.create_bulk copies
+read-only strided arrays that would need more into contiguous memory.
+"""
+max_segments = _pymargo.max_bulk_segments
+
+"""
+Margo instance in which Bulk objects are deserialized, set by
+serialization.loads around each call to pickle.loads. Being a
+ContextVar, it is local to each thread (hence to each execution
+stream running RPC handlers), so that handlers can decode Bulk
+objects concurrently, possibly for different Engines.
+"""
+current_mid: 'ContextVar[Optional[margo_instance_id]]' = \
+    ContextVar('pymargo_current_mid', default=None)
+
+"""
+Address of the sender of the data being deserialized, or a function
+returning it, set along with current_mid by serialization.loads when
+the address is known (e.g. when decoding the input of an RPC).
+"""
+current_addr: 'ContextVar[Union[hg_addr_t, Callable[[], hg_addr_t], None]]' \
+    = ContextVar('pymargo_current_addr', default=None)
+
+
+def _segment_count(data: Any) -> int:
+    """
+    Number of segments with which bulk_create exposes the memory of a
+    buffer-protocol object (at most): one per element of its outer
+    dimensions, its innermost contiguous dimensions being merged.
+    """
+    with memoryview(data) as view:
+        block = view.itemsize
+        outer = view.ndim
+        while outer > 0 and view.strides[outer - 1] == block:
+            block *= view.shape[outer - 1]
+            outer -= 1
+        count = 1
+        for dim in view.shape[:outer]:
+            count *= dim
+        return 0 if block == 0 else count
+
+
+def _staged(data: Any, mode: _pymargo.access) -> Any:
+    """
+    Returns data (a buffer-protocol object or a list of such objects),
+    or, if exposing it would take more than max_segments segments, a
+    copy of it in which strided buffers are replaced by contiguous
+    copies of their content (in C order). Memory written by transfers
+    cannot be staged this way, so ValueError is raised for writable
+    modes.
+    """
+    items = list(data) if isinstance(data, (list, tuple)) else [data]
+    counts = [_segment_count(item) for item in items]
+    if sum(counts) <= max_segments:
+        return data
+    if mode != read_only:
+        raise ValueError(
+            f"Cannot expose writable memory as more than {max_segments} "
+            f"segments, a contiguous buffer must be used instead")
+    staged = [memoryview(item).tobytes() if count > 1 else item
+              for item, count in zip(items, counts)]
+    return staged if isinstance(data, (list, tuple)) else staged[0]
+
 
 class Bulk:
     """
@@ -25,15 +100,16 @@ class Bulk:
     enable serialization/deserialization to send them in RPCs.
     """
 
-    _current_mid: Optional[margo_instance_id] = None
-
-    def __init__(self, hg_bulk: hg_bulk_t):
+    def __init__(self, hg_bulk: hg_bulk_t, request_eager: bool = False):
         """
         Constructor. This method is not supposed to be called by users.
         Users must call Engine.create_bulk instead.
         hg_bulk : native hg_bulk_t handle.
+        request_eager : whether to embed the content of the memory
+                        in the serialized handle (see request_eager).
         """
         self._hg_bulk = hg_bulk
+        self._request_eager = request_eager
 
     def __del__(self) -> None:
         """
@@ -42,14 +118,462 @@ class Bulk:
         if hasattr(self, '_hg_bulk'):
             _pymargo.bulk_free(self._hg_bulk)
 
+    @property
+    def request_eager(self) -> bool:
+        """
+        Whether the content of the exposed memory is sent along with the
+        serialized handle. Mercury only honors this for small read-only
+        handles; the receiver can then pull from the handle without any
+        RDMA operation.
+        """
+        return self._request_eager
+
+    @request_eager.setter
+    def request_eager(self, value: bool) -> None:
+        self._request_eager = value
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the memory exposed by the handle.
+        """
+        return _pymargo.bulk_get_size(self._hg_bulk)
+
     def __getstate__(self):
-        return _pymargo.bulk_to_str(self._hg_bulk, False)
+        return _pymargo.bulk_to_str(self._hg_bulk, self._request_eager)
 
     def __setstate__(self, state: bytes):
-        if not hasattr(Bulk, '_current_mid'):
+        mid = current_mid.get()
+        if mid is None:
             raise RuntimeError(
-                "Could not reconstruct Bulk object: no Bulk._current_mid set")
-        if Bulk._current_mid is None:
-            raise RuntimeError(
-                "Could not reconstruct Bulk object: no Bulk._current_mid set")
-        self._hg_bulk = _pymargo.str_to_bulk(Bulk._current_mid, state)
+                "Could not reconstruct Bulk object: no current_mid set")
+        self._hg_bulk = _pymargo.str_to_bulk(mid, state)
+        self._request_eager = False
+
+
+def _bulk_from_state(state: bytes) -> Bulk:
+    bulk = Bulk.__new__(Bulk)
+    bulk.__setstate__(state)
+    return bulk
+
+
+class FileBulk(Bulk):
+    """
+    Bulk handle exposing a region of a file mapped in memory, so that
+    remote processes can pull from the page cache, or push into the
+    file, without the data being copied into Python objects.
+    Users must call Engine.create_file_bulk instead of instantiating
+    this class directly. The mapping is released along with the handle.
+    A FileBulk is serialized as a plain Bulk.
+    """
+
+    def __init__(self, mid: margo_instance_id,
+                 path: Union[str, os.PathLike], offset: int,
+                 length: Optional[int], mode: _pymargo.access):
+        """
+        Constructor.
+        mid : margo instance in which to register the mapping.
+        path : path of the file.
+        offset : offset of the region in the file.
+        length : size of the region (None to go to the end of the file).
+                 With a writable mode, the file is created and extended
+                 if needed.
+        mode : bulk.read_only, bulk.write_only, or bulk.read_write.
+        """
+        writable = mode != read_only
+        flags = os.O_RDWR | os.O_CREAT if writable else os.O_RDONLY
+        with open(os.open(path, flags, 0o666),
+                  'r+b' if writable else 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if length is None:
+                length = file_size - offset
+            if length <= 0:
+                raise ValueError(
+                    f"Cannot map {length} bytes at offset {offset} "
+                    f"of {path}")
+            if offset + length > file_size:
+                if not writable:
+                    raise ValueError(
+                        f"Region [{offset}, {offset + length}) is beyond "
+                        f"the end of {path} ({file_size} bytes)")
+                os.ftruncate(f.fileno(), offset + length)
+            # mappings must start on an allocation granularity boundary
+            self._delta = offset % mmap.ALLOCATIONGRANULARITY
+            self._mmap = mmap.mmap(
+                f.fileno(), length + self._delta,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ,
+                offset=offset - self._delta)
+        self._view = memoryview(self._mmap)[self._delta:]
+        super().__init__(_pymargo.bulk_create(mid, self._view, mode))
+
+    def __del__(self) -> None:
+        """
+        Destructor. Frees the hg_bulk_t handle, then unmaps the file.
+        """
+        super().__del__()
+        if hasattr(self, '_mmap'):
+            self._view.release()
+            self._mmap.close()
+
+    def __reduce__(self):
+        return _bulk_from_state, (self.__getstate__(),)
+
+    @property
+    def buffer(self) -> memoryview:
+        """
+        View of the mapped region, for local access.
+        """
+        return self._view
+
+    def flush(self, offset: int = 0, length: Optional[int] = None) -> None:
+        """
+        Writes back the modified pages of the given part of the region
+        to the file (msync), e.g. after a remote process pushed to it.
+        offset : offset relative to the start of the region.
+        length : size of the part to flush (None for the rest of it).
+        """
+        if length is None:
+            length = len(self._view) - offset
+        # msync requires page-aligned addresses
+        start = self._delta + offset
+        aligned = start - start % mmap.ALLOCATIONGRANULARITY
+        self._mmap.flush(aligned, length + start - aligned)
+
+
+class BufferPool:
+    """
+    Set of buffers allocated and registered (as read_write Bulk handles)
+    once, to be leased by handlers instead of creating and freeing a
+    Bulk handle per request. Memory registration is costly on RDMA
+    transports. Users must call Engine.buffer_pool instead of
+    instantiating this class directly.
+
+    Buffers are organized in size classes. A request for n bytes is
+    served by the smallest class able to hold n bytes that has a free
+    buffer. When none has, the caller blocks until a buffer is released.
+    """
+
+    def __init__(self, mid: margo_instance_id, sizes: Sequence[int],
+                 count: int):
+        """
+        Constructor.
+        mid : margo instance in which to register the buffers.
+        sizes : sizes of the buffers, in bytes (one class per size).
+        count : number of buffers of each size.
+        """
+        if count <= 0 or not sizes or min(sizes) <= 0:
+            raise ValueError("sizes and count must be positive")
+        self._mid = mid
+        self._sizes: List[int] = sorted(set(sizes))
+        self._free: Dict[int, Deque[Tuple[bytearray, Bulk]]] = {}
+        for size in self._sizes:
+            self._free[size] = deque()
+            for _ in range(count):
+                buf = bytearray(size)
+                hg_bulk = _pymargo.bulk_create(mid, buf, read_write)
+                self._free[size].append((buf, Bulk(hg_bulk)))
+        self._capacity = count * len(self._sizes)
+        self._leased: Dict[int, Tuple[int, bytearray, Bulk]] = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._acquisitions = 0
+        self._waits = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _try_acquire(self, size: int) -> Optional[Tuple[memoryview, Bulk]]:
+        # must be called with the lock held
+        for cls in self._sizes[bisect.bisect_left(self._sizes, size):]:
+            if self._free[cls]:
+                buf, bulk = self._free[cls].popleft()
+                view = memoryview(buf)[:size]
+                self._leased[id(bulk)] = (cls, buf, bulk)
+                self._acquisitions += 1
+                return view, bulk
+        return None
+
+    def acquire(self, size: int, timeout: Optional[float] = None) \
+            -> Tuple[memoryview, Bulk]:
+        """
+        Leases a buffer of at least size bytes. Returns a memoryview of
+        its first size bytes and the Bulk handle exposing the whole
+        buffer. The buffer must be given back with release.
+        timeout : maximum time to wait for a buffer, in seconds
+                  (None to wait indefinitely). TimeoutError is raised
+                  when it expires.
+        """
+        if size > self._sizes[-1]:
+            raise ValueError(
+                f"No buffer of {size} bytes in the pool "
+                f"(largest is {self._sizes[-1]} bytes)")
+        with self._released:
+            lease = self._try_acquire(size)
+            if lease is None:
+                start = time.monotonic()
+                deadline = None if timeout is None else start + timeout
+                while lease is None:
+                    remaining = None if deadline is None \
+                        else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._record_wait(time.monotonic() - start)
+                        raise TimeoutError(
+                            f"No buffer of {size} bytes available "
+                            f"after {timeout} seconds")
+                    self._released.wait(remaining)
+                    lease = self._try_acquire(size)
+                self._record_wait(time.monotonic() - start)
+            return lease
+
+    def _record_wait(self, waited: float) -> None:
+        # must be called with the lock held
+        self._waits += 1
+        self._total_wait_time += waited
+        self._max_wait_time = max(self._max_wait_time, waited)
+
+    def release(self, view: memoryview, bulk: Bulk) -> None:
+        """
+        Gives back a buffer obtained from acquire, releasing the
+        memoryview. BufferError is raised, and the buffer remains
+        leased, if objects holding a buffer exported by the view (e.g.
+        NumPy arrays created from it) are still alive.
+        """
+        with self._released:
+            if id(bulk) not in self._leased:
+                raise ValueError("Buffer not leased from this pool")
+            view.release()
+            cls, buf, _ = self._leased.pop(id(bulk))
+            self._free[cls].append((buf, bulk))
+            self._released.notify()
+
+    @contextmanager
+    def lease(self, size: int, timeout: Optional[float] = None) \
+            -> Iterator[Tuple[memoryview, Bulk]]:
+        """
+        Context manager calling acquire on entry and release on exit.
+
+        with pool.lease(size) as (view, local_bulk):
+            engine.transfer(bulk.pull, addr, remote_bulk, 0,
+                            local_bulk, 0, size)
+            process(view)
+        """
+        view, bulk = self.acquire(size, timeout)
+        try:
+            yield view, bulk
+        finally:
+            self.release(view, bulk)
+
+    @property
+    def sizes(self) -> List[int]:
+        """
+        Sizes of the buffers, in increasing order.
+        """
+        return list(self._sizes)
+
+    @property
+    def capacity(self) -> int:
+        """
+        Total number of buffers.
+        """
+        return self._capacity
+
+    @property
+    def in_use(self) -> int:
+        """
+        Number of buffers currently leased.
+        """
+        return len(self._leased)
+
+    @property
+    def occupancy(self) -> float:
+        """
+        Fraction of the buffers currently leased.
+        """
+        return len(self._leased) / self._capacity
+
+    @property
+    def acquisitions(self) -> int:
+        """
+        Number of buffers leased since the creation of the pool.
+        """
+        return self._acquisitions
+
+    @property
+    def waits(self) -> int:
+        """
+        Number of calls to acquire that had to wait for a buffer.
+        """
+        return self._waits
+
+    @property
+    def total_wait_time(self) -> float:
+        """
+        Cumulated time spent waiting for buffers, in seconds.
+        """
+        return self._total_wait_time
+
+    @property
+    def max_wait_time(self) -> float:
+        """
+        Longest time spent waiting for a buffer, in seconds.
+        """
+        return self._max_wait_time
+
+
+class RemoteBuffer:
+    """
+    Read-only, bytes-like view of the memory exposed by a remote Bulk
+    handle, pulling only the ranges that are actually accessed:
+
+        buf = RemoteBuffer(bulk, handle.address)
+        header = buf[0:64]
+        record = buf[offset:offset+size]
+
+    Data is pulled by blocks of block_size bytes, kept in an LRU cache
+    of cache_blocks blocks. An access that misses the cache also pulls
+    the readahead blocks that follow it. Missing blocks that are
+    adjacent are pulled with a single transfer, and the transfers of
+    an access are issued concurrently. The cache must be cleared (see
+    clear) if the remote memory is modified.
+    """
+
+    def __init__(self, bulk: Bulk, address: 'Address',
+                 block_size: int = 65536, cache_blocks: int = 64,
+                 readahead: int = 1):
+        """
+        Constructor.
+        bulk : remote Bulk handle (e.g. received as an RPC argument).
+        address : Address of the process that created the handle.
+        block_size : size of the blocks pulled and cached.
+        cache_blocks : maximum number of cached blocks.
+        readahead : number of blocks pulled after those accessed.
+        """
+        if block_size <= 0 or cache_blocks <= 0 or readahead < 0:
+            raise ValueError("Invalid RemoteBuffer parameters")
+        self._bulk = bulk
+        # copied, since addresses of RPC handles do not outlive them
+        self._address = address.copy()
+        self._mid = self._address._mid
+        self._size = bulk.size
+        self._block_size = block_size
+        self._readahead = readahead
+        self._cache = LRU(maxsize=cache_blocks)
+        self._transfers = 0
+        self._bytes_transferred = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[int, bytes]:
+        if isinstance(key, slice):
+            indices = range(*key.indices(self._size))
+            if not indices:
+                return b''
+            low = min(indices[0], indices[-1])
+            high = max(indices[0], indices[-1]) + 1
+            data = self.read(low, high - low)
+            if indices.step == 1:
+                return data
+            return data[indices[0] - low::indices.step][:len(indices)]
+        index = key + self._size if key < 0 else key
+        if not 0 <= index < self._size:
+            raise IndexError("RemoteBuffer index out of range")
+        return self.read(index, 1)[0]
+
+    def read(self, offset: int, length: int) -> bytes:
+        """
+        Returns length bytes starting at offset, pulling the blocks
+        that are not cached.
+        """
+        if offset < 0 or length < 0 or offset + length > self._size:
+            raise ValueError(
+                f"Range [{offset}, {offset + length}) is out of the "
+                f"bounds of the buffer ({self._size} bytes)")
+        if length == 0:
+            return b''
+        first = offset // self._block_size
+        last = (offset + length - 1) // self._block_size
+        blocks: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for index in range(first, last + 1):
+            block = self._cache.get(index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+        if missing:
+            num_blocks = (self._size + self._block_size - 1) \
+                // self._block_size
+            for index in range(last + 1,
+                               min(last + 1 + self._readahead, num_blocks)):
+                if self._cache.get(index) is None:
+                    missing.append(index)
+            blocks.update(self._pull_blocks(missing))
+        result = b''.join(blocks[i] for i in range(first, last + 1))
+        start = offset - first * self._block_size
+        return result[start:start + length]
+
+    def _pull_blocks(self, indices: List[int]) -> Dict[int, bytes]:
+        # adjacent blocks are coalesced into runs pulled at once
+        runs: List[Tuple[int, int]] = []
+        for index in indices:
+            if runs and runs[-1][0] + runs[-1][1] == index:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((index, 1))
+        buffers = []
+        requests = []
+        local_bulks = []
+        try:
+            for first, count in runs:
+                offset = first * self._block_size
+                size = min(count * self._block_size, self._size - offset)
+                buf = bytearray(size)
+                local_bulk = _pymargo.bulk_create(self._mid, buf, write_only)
+                local_bulks.append(local_bulk)
+                requests.append(_pymargo.bulk_itransfer(
+                    self._mid, pull, self._address._hg_addr,
+                    self._bulk._hg_bulk, offset, local_bulk, 0, size))
+                buffers.append((first, buf))
+        finally:
+            rets = _pymargo.request_wait_all(requests)
+            for local_bulk in local_bulks:
+                _pymargo.bulk_free(local_bulk)
+        for ret in rets:
+            if ret != 0:
+                raise _pymargo.MargoException(
+                    f"margo_bulk_itransfer() completed with {ret}")
+        blocks: Dict[int, bytes] = {}
+        for first, buf in buffers:
+            self._transfers += 1
+            self._bytes_transferred += len(buf)
+            view = memoryview(buf)
+            for i in range(0, len(buf), self._block_size):
+                block = bytes(view[i:i + self._block_size])
+                index = first + i // self._block_size
+                blocks[index] = block
+                self._cache.put(index, block)
+        return blocks
+
+    def clear(self) -> None:
+        """
+        Drops the cached blocks.
+        """
+        self._cache.clear()
+
+    @property
+    def cache(self) -> LRU:
+        """
+        Cache of blocks, indexed by block number.
+        """
+        return self._cache
+
+    @property
+    def transfers(self) -> int:
+        """
+        Number of bulk transfers issued.
+        """
+        return self._transfers
+
+    @property
+    def bytes_transferred(self) -> int:
+        return self._bytes_transferred
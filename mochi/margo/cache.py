@@ -0,0 +1,172 @@
+# (C) 2022 The University of Chicago
+# See COPYRIGHT in top-level directory.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class LRU:
+    """
+    Bounded cache of serialized RPC responses, with least-recently-used
+    eviction. Passed to @remote(cache=...) or Engine.register(cache=...),
+    it lets the server answer repeated requests whose raw input is
+    identical without decoding them nor running the handler. It is also
+    used by RemoteFunction.enable_client_cache on the client side.
+    maxsize : maximum number of entries
+    ttl : lifetime of an entry in seconds (None for no expiration)
+    max_bytes : bound on the total size of the entries (None for none)
+    The cache must only be used with idempotent, read-only RPCs,
+    and must be invalidated when the data they return changes.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        # key -> (value, expiration time, size)
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, float, int]]' = \
+            OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the value cached for the key, or None if there is
+        no such value or if it has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def lookup(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """
+        Same as get, but also returns expired values (which get removes),
+        along with whether the value is still fresh. This is meant for
+        stale-while-revalidate policies.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if entry[1] < time.monotonic():
+                self._stale_hits += 1
+                return entry[0], False
+            self._hits += 1
+            return entry[0], True
+
+    def put(self, key: Hashable, value: Any,
+            size: Optional[int] = None) -> None:
+        """
+        Caches a value. size is the number of bytes accounted for the
+        entry (len(value) by default). Least recently used entries are
+        evicted to honor maxsize and max_bytes. A value larger than
+        max_bytes is not cached.
+        """
+        if size is None:
+            size = len(value)
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        expiration = float('inf') if self._ttl is None \
+            else time.monotonic() + self._ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expiration, size)
+            self._nbytes += size
+            while len(self._entries) > self._maxsize or \
+                    (self._max_bytes is not None
+                     and self._nbytes > self._max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """
+        Removes the entry of the key. Returns whether there was one.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def invalidate_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Removes the entries whose key satisfies the predicate.
+        Returns the number of removed entries.
+        """
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        """
+        Removes all the entries. Counters are not reset.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._entries.pop(key)
+        self._nbytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Total size of the cached entries.
+        """
+        return self._nbytes
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def stale_hits(self) -> int:
+        """
+        Number of expired values returned by lookup.
+        """
+        return self._stale_hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def evictions(self) -> int:
+        """
+        Number of entries evicted to honor maxsize and max_bytes.
+        """
+        return self._evictions
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        Ratio of lookups that found a fresh value.
+        """
+        lookups = self._hits + self._stale_hits + self._misses
+        return self._hits / lookups if lookups else 0.0
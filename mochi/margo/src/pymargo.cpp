@@ -8,6 +8,15 @@
 #include <sstream>
 #include <stdexcept>
 #include <iostream>
+#include <memory>
+#include <mutex>
+#include <vector>
+#include <utility>
+#include <unistd.h>
+#include <fcntl.h>
+#ifdef __linux__
+#include <sys/eventfd.h>
+#endif
 #include <mercury_proc_string.h>
 #include <margo.h>
 
@@ -32,6 +41,10 @@ typedef py11::capsule pymargo_request;
 
 struct __attribute__ ((visibility("hidden"))) pymargo_rpc_data {
     py11::object callable;
+    bool         input_as_memoryview = false;
+    /* cached copy of margo's disabled-response flag for this RPC,
+     * kept up to date by pymargo_disable_response */
+    bool         disabled_response = false;
 };
 
 struct pymargo_hg_handle {
@@ -42,12 +55,13 @@ struct pymargo_hg_handle {
     ~pymargo_hg_handle();
     hg_id_t get_id() const;
     pymargo_addr _get_hg_addr() const;
-    py11::object forward(uint16_t provider_id, py11::bytes input, double timeout);
-    pymargo_request iforward(uint16_t provider_id, py11::bytes input, double timeout);
-    void respond(py11::bytes output);
-    pymargo_request irespond(py11::bytes output);
+    py11::object forward(uint16_t provider_id, const py11::object& input, double timeout,
+                         bool as_memoryview = false);
+    pymargo_request iforward(uint16_t provider_id, const py11::object& input, double timeout);
+    void respond(const py11::object& output, bool error = false);
+    pymargo_request irespond(const py11::object& output, bool error = false);
     pymargo_instance_id _get_mid() const;
-    py11::object _get_output() const;
+    py11::object _get_output(bool as_memoryview = false) const;
 };
 
 void delete_rpc_data(void* arg) {
@@ -87,29 +101,121 @@ struct pymargo_exception : public std::runtime_error {
     hg_return_t code;
 };
 
-static hg_return_t hg_proc_py11bytes(hg_proc_t proc, void *data) {
-    py11::bytes* bytes = static_cast<py11::bytes*>(data);
+/* Raised by _get_output when the handler responded with an error.
+ * The message is the error envelope sent by the handler. */
+struct pymargo_remote_error : public std::runtime_error {
+
+    explicit pymargo_remote_error(const std::string& envelope)
+    : std::runtime_error(envelope) {}
+};
+
+/* Payload of the requests and responses of pymargo RPCs.
+ * When encoding, data and size point to the memory of a buffer-protocol
+ * object held by the caller (see pymargo_buffer_view), so the payload
+ * is copied only once, directly into Mercury's buffer, and the GIL is
+ * not needed. When decoding, obj receives a new bytes object, unless
+ * view is set, in which case data and size point into Mercury's buffer
+ * (see pymargo_payload_view). */
+struct pymargo_payload {
+    const char*  data = nullptr;
+    hg_size_t    size = 0;
+    py11::object obj;
+    bool         view = false;
+    uint8_t      status = 0;
+};
+
+/* Responses carry a status byte before the payload,
+ * non-zero when the payload is an error envelope. */
+typedef pymargo_payload pymargo_output;
+
+/* Exposes a decoded payload, without copying it, to Python through the
+ * buffer protocol. The payload stays valid as long as this object is
+ * alive: it holds a reference to the handle and frees the handle's
+ * input (or output) only when destroyed. */
+struct pymargo_payload_view {
+
+    pymargo_hg_handle handle;
+    const char*       data;
+    hg_size_t         size;
+    bool              is_input;
+
+    pymargo_payload_view(const pymargo_hg_handle& h,
+                         const pymargo_payload& p,
+                         bool input)
+    : handle(h), data(p.data), size(p.size), is_input(input) {}
+
+    pymargo_payload_view(const pymargo_payload_view&) = delete;
+
+    ~pymargo_payload_view() {
+        pymargo_payload p;
+        if(is_input) margo_free_input(handle.handle, &p);
+        else margo_free_output(handle.handle, &p);
+    }
+
+    /* Returns a read-only memoryview of the payload. */
+    static py11::object wrap(const pymargo_hg_handle& h,
+                             const pymargo_payload& p,
+                             bool input) {
+        py11::object owner = py11::cast(
+            new pymargo_payload_view(h, p, input),
+            py11::return_value_policy::take_ownership);
+        PyObject* mv = PyMemoryView_FromObject(owner.ptr());
+        if(!mv) throw py11::error_already_set();
+        return py11::reinterpret_steal<py11::object>(mv);
+    }
+};
+
+/* RAII wrapper for the Py_buffer of a contiguous buffer-protocol object.
+ * Must be constructed and destroyed with the GIL held. */
+class pymargo_buffer_view {
+
+    Py_buffer view_m;
+
+    public:
+
+    explicit pymargo_buffer_view(const py11::object& obj) {
+        if(PyObject_GetBuffer(obj.ptr(), &view_m, PyBUF_C_CONTIGUOUS) != 0)
+            throw py11::error_already_set();
+    }
+
+    pymargo_buffer_view(const pymargo_buffer_view&) = delete;
+
+    ~pymargo_buffer_view() {
+        PyBuffer_Release(&view_m);
+    }
+
+    pymargo_payload payload() const {
+        pymargo_payload p;
+        p.data = static_cast<const char*>(view_m.buf);
+        p.size = view_m.len;
+        return p;
+    }
+};
+
+static hg_return_t hg_proc_pymargo_payload(hg_proc_t proc, void *data) {
+    pymargo_payload* payload = static_cast<pymargo_payload*>(data);
     hg_return ret = HG_SUCCESS;
     switch(hg_proc_get_op(proc)) {
     case HG_DECODE: {
-        ssize_t len = 0;
+        hg_size_t len = 0;
         ret = hg_proc_hg_size_t(proc, &len);
         if(ret != HG_SUCCESS) return ret;
         void* buf = hg_proc_save_ptr(proc, len);
-        *bytes = py11::bytes((char*)buf, len);
+        if(payload->view) {
+            payload->data = static_cast<const char*>(buf);
+            payload->size = len;
+        } else {
+            payload->obj = py11::bytes((char*)buf, len);
+        }
         hg_proc_restore_ptr(proc, buf, len);
         break;
     }
     case HG_ENCODE: {
-        char* data = nullptr;
-        ssize_t len = 0;
-        if(PyBytes_AsStringAndSize(bytes->ptr(), &data, &len)) {
-            throw py11::error_already_set();
-        }
+        hg_size_t len = payload->size;
         ret = hg_proc_hg_size_t(proc, &len);
         if(ret != HG_SUCCESS) return ret;
         void* buf = hg_proc_save_ptr(proc, len);
-        memcpy(buf, data, len);
+        memcpy(buf, payload->data, len);
         hg_proc_restore_ptr(proc, buf, len);
         break;
     }
@@ -119,6 +225,16 @@ static hg_return_t hg_proc_py11bytes(hg_proc_t proc, void *data) {
     return ret;
 }
 
+/* The output of an RPC starts with a status byte (non-zero when the
+ * payload is the envelope of a handler's exception). This makes the wire
+ * format of responses incompatible with py-margo versions prior to 0.7. */
+static hg_return_t hg_proc_pymargo_output(hg_proc_t proc, void *data) {
+    pymargo_output* output = static_cast<pymargo_output*>(data);
+    hg_return ret = hg_proc_uint8_t(proc, &output->status);
+    if(ret != HG_SUCCESS) return ret;
+    return hg_proc_pymargo_payload(proc, data);
+}
+
 static pymargo_instance_id pymargo_init(
         const std::string& addr,
         pymargo_mode mode,
@@ -129,13 +245,16 @@ static pymargo_instance_id pymargo_init(
     int l = num_rpc_threads;
     if(mode == PYMARGO_CLIENT_MODE) l = 0;
     margo_instance_id mid;
-    if(config.empty()) {
-        mid = margo_init(addr.c_str(), mode, (int)use_progress_thread, l);
-    } else {
-        struct margo_init_info info;
-        std::memset(&info, 0, sizeof(info));
-        info.json_config = config.c_str();
-        mid = margo_init_ext(addr.c_str(), mode, &info);
+    {
+        py11::gil_scoped_release release;
+        if(config.empty()) {
+            mid = margo_init(addr.c_str(), mode, (int)use_progress_thread, l);
+        } else {
+            struct margo_init_info info;
+            std::memset(&info, 0, sizeof(info));
+            info.json_config = config.c_str();
+            mid = margo_init_ext(addr.c_str(), mode, &info);
+        }
     }
     if(mid == MARGO_INSTANCE_NULL) {
         throw std::runtime_error("margo_init() returned MARGO_INSTANCE_NULL");
@@ -180,19 +299,13 @@ static hg_return_t pymargo_generic_rpc_callback(hg_handle_t handle)
     margo_instance_id mid      = MARGO_INSTANCE_NULL;
     const struct hg_info* info = NULL;
     py11::gil_scoped_acquire acquire;
-    py11::bytes input;
+    pymargo_payload input;
 
     mid  = margo_hg_handle_get_instance(handle);
     info = margo_get_info(handle);
-    ret  = margo_get_input(handle, &input);
-
-    if(ret != HG_SUCCESS) {
-        result = ret;
-        margo_free_input(handle, &input);
-        margo_destroy(handle);
-        throw pymargo_exception("margo_get_input", ret);
-    }
 
+    /* the registered data holds the callable along with a copy of the
+     * RPC's flags, so a single lookup is made per request */
     pymargo_rpc_data* rpc_data = NULL;
     void* data = margo_registered_data(mid, info->id);
     rpc_data = static_cast<pymargo_rpc_data*>(data);
@@ -203,15 +316,29 @@ static hg_return_t pymargo_generic_rpc_callback(hg_handle_t handle)
         return HG_OTHER_ERROR;
     }
 
-    int disabled_flag;
-    margo_registered_disabled_response(mid, info->id, &disabled_flag);
+    input.view = rpc_data->input_as_memoryview;
+    ret = margo_get_input(handle, &input);
 
-    if(!disabled_flag) {
-        std::string out;
+    if(ret != HG_SUCCESS) {
+        result = ret;
+        margo_free_input(handle, &input);
+        margo_destroy(handle);
+        throw pymargo_exception("margo_get_input", ret);
+    }
+
+    /* when the input is passed as a memoryview, the view frees it */
+    bool input_freed_by_view = false;
+
+    if(!rpc_data->disabled_response) {
         try {
             pymargo_hg_handle pyhandle(handle);
             margo_ref_incr(handle);
-            py11::object r = rpc_data->callable(pyhandle, input);
+            py11::object py_input = input.obj;
+            if(input.view) {
+                py_input = pymargo_payload_view::wrap(pyhandle, input, true);
+                input_freed_by_view = true;
+            }
+            py11::object r = rpc_data->callable(pyhandle, py_input);
         } catch(const py11::error_already_set& e) {
             std::cerr << "[Py-Margo] ERROR: " << e.what() << std::endl;
             result = HG_OTHER_ERROR;
@@ -221,8 +348,10 @@ static hg_return_t pymargo_generic_rpc_callback(hg_handle_t handle)
         }
     }
 
-    ret = margo_free_input(handle, &input);
-    if(ret != HG_SUCCESS) result = ret;
+    if(!input_freed_by_view) {
+        ret = margo_free_input(handle, &input);
+        if(ret != HG_SUCCESS) result = ret;
+    }
 
     ret = margo_destroy(handle);
     if(ret != HG_SUCCESS) result = ret;
@@ -231,22 +360,58 @@ static hg_return_t pymargo_generic_rpc_callback(hg_handle_t handle)
 }
 DEFINE_MARGO_RPC_HANDLER(pymargo_generic_rpc_callback)
 
+static margo_pool_info pymargo_find_pool_info(
+        pymargo_instance_id mid,
+        const py11::object& pool)
+{
+    margo_pool_info info;
+    hg_return_t ret;
+    if(py11::isinstance<py11::str>(pool)) {
+        auto name = pool.cast<std::string>();
+        ret = margo_find_pool_by_name(mid, name.c_str(), &info);
+        if(ret != HG_SUCCESS)
+            throw pymargo_exception("margo_find_pool_by_name", ret);
+    } else {
+        auto index = pool.cast<uint32_t>();
+        ret = margo_find_pool_by_index(mid, index, &info);
+        if(ret != HG_SUCCESS)
+            throw pymargo_exception("margo_find_pool_by_index", ret);
+    }
+    return info;
+}
+
+static py11::tuple pymargo_find_pool(
+        pymargo_instance_id mid,
+        const py11::object& pool)
+{
+    margo_pool_info info = pymargo_find_pool_info(mid, pool);
+    return py11::make_tuple(std::string(info.name), info.index);
+}
+
 static hg_id_t pymargo_register(
         pymargo_instance_id mid,
         const std::string& rpc_name,
         uint16_t provider_id,
-        py11::object callable)
+        py11::object callable,
+        bool input_as_memoryview,
+        const py11::object& pool)
 {
     hg_return_t ret;
 
+    // None means the default handler pool
+    ABT_pool abt_pool = ABT_POOL_NULL;
+    if(!pool.is_none())
+        abt_pool = pymargo_find_pool_info(mid, pool).pool;
+
     hg_id_t rpc_id;
     rpc_id = MARGO_REGISTER_PROVIDER(mid, rpc_name.c_str(),
-            py11bytes, py11bytes, pymargo_generic_rpc_callback,
-            provider_id, ABT_POOL_NULL);
+            pymargo_payload, pymargo_output, pymargo_generic_rpc_callback,
+            provider_id, abt_pool);
 
     pymargo_rpc_data* rpc_data = new pymargo_rpc_data;
     rpc_data->callable = callable;
     rpc_data->callable.inc_ref();
+    rpc_data->input_as_memoryview = input_as_memoryview;
 
     ret = margo_register_data(mid, rpc_id,
                 static_cast<void*>(rpc_data), delete_rpc_data);
@@ -266,7 +431,7 @@ static hg_id_t pymargo_register_on_client(
     rpc_id = MARGO_REGISTER_PROVIDER(
                     mid,
                     rpc_name.c_str(),
-                    py11bytes, py11bytes, NULL,
+                    pymargo_payload, pymargo_output, NULL,
                     provider_id, ABT_POOL_NULL);
     if(rpc_id == 0) {
         throw pymargo_exception("margo_register_provider", (hg_return_t)0);
@@ -295,6 +460,10 @@ static void pymargo_disable_response(
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_deregistered_disable_response", ret);
     }
+    /* client-side registrations have no rpc data */
+    auto rpc_data = static_cast<pymargo_rpc_data*>(
+        margo_registered_data(mid, id));
+    if(rpc_data) rpc_data->disabled_response = disable_flag;
 }
 
 static bool pymargo_disabled_response(
@@ -361,9 +530,11 @@ static pymargo_addr pymargo_lookup(
     hg_addr_t addr;
     hg_return_t ret;
 
+    Py_BEGIN_ALLOW_THREADS
     ret = margo_addr_lookup(
             mid,
             addrstr.c_str(), &addr);
+    Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_addr_lookup", ret);
     }
@@ -375,7 +546,9 @@ static void pymargo_addr_free(
         pymargo_addr pyaddr)
 {
     hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
     ret = margo_addr_free(mid, pyaddr);
+    Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_addr_free", ret);
     }
@@ -472,21 +645,24 @@ pymargo_hg_handle::~pymargo_hg_handle()
 }
 
 py11::object pymargo_hg_handle::forward(uint16_t provider_id,
-                                        py11::bytes input,
-                                        double timeout)
+                                        const py11::object& input,
+                                        double timeout,
+                                        bool as_memoryview)
 {
     hg_return_t ret;
+    pymargo_buffer_view view(input);
+    pymargo_payload in = view.payload();
 
     Py_BEGIN_ALLOW_THREADS
-    ret = margo_provider_forward_timed(provider_id, handle, &input, timeout);
+    ret = margo_provider_forward_timed(provider_id, handle, &in, timeout);
     Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_provider_forward_timed", ret);
     }
-    return _get_output();
+    return _get_output(as_memoryview);
 }
 
-py11::object pymargo_hg_handle::_get_output() const {
+py11::object pymargo_hg_handle::_get_output(bool as_memoryview) const {
     hg_return_t ret;
     int disabled_flag;
     auto mid = margo_hg_handle_get_instance(handle);
@@ -495,7 +671,8 @@ py11::object pymargo_hg_handle::_get_output() const {
     margo_registered_disabled_response(mid, info->id, &disabled_flag);
 
     if(!disabled_flag) {
-        py11::bytes out;
+        pymargo_payload out;
+        out.view = as_memoryview;
         ret = margo_get_output(handle, &out);
         if(ret == HG_TIMEOUT) {
             PyErr_SetString(PyExc_TimeoutError, "Margo forward timed out");
@@ -504,25 +681,40 @@ py11::object pymargo_hg_handle::_get_output() const {
         if(ret != HG_SUCCESS) {
             throw pymargo_exception("margo_get_output", ret);
         }
+        if(out.status != 0) {
+            std::string envelope;
+            if(as_memoryview) envelope.assign(out.data, out.size);
+            else envelope = out.obj.cast<std::string>();
+            margo_free_output(handle, &out);
+            throw pymargo_remote_error(envelope);
+        }
+        if(as_memoryview) {
+            /* the output is freed when the view is released */
+            return pymargo_payload_view::wrap(*this, out, false);
+        }
         ret = margo_free_output(handle, &out);
         if(ret != HG_SUCCESS) {
             throw pymargo_exception("margo_free_output", ret);
         }
-        return out;
+        return out.obj;
     } else {
         return py11::none();
     }
 }
 
 pymargo_request pymargo_hg_handle::iforward(uint16_t provider_id,
-                                            py11::bytes input,
+                                            const py11::object& input,
                                             double timeout)
 {
     hg_return_t ret;
     margo_request req;
+    pymargo_buffer_view view(input);
+    pymargo_payload in = view.payload();
 
+    /* the input is serialized into the handle before this call returns,
+     * so the buffer does not need to outlive it */
     Py_BEGIN_ALLOW_THREADS
-    ret = margo_provider_iforward_timed(provider_id, handle, &input, timeout, &req);
+    ret = margo_provider_iforward_timed(provider_id, handle, &in, timeout, &req);
     Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_provider_iforward_timed", ret);
@@ -530,23 +722,30 @@ pymargo_request pymargo_hg_handle::iforward(uint16_t provider_id,
     return pymargo_request(req);
 }
 
-void pymargo_hg_handle::respond(py11::bytes output)
+void pymargo_hg_handle::respond(const py11::object& output, bool error)
 {
     hg_return_t ret;
+    pymargo_buffer_view view(output);
+    pymargo_output out = view.payload();
+    out.status = error ? 1 : 0;
     Py_BEGIN_ALLOW_THREADS
-    ret = margo_respond(handle, &output);
+    ret = margo_respond(handle, &out);
     Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_respond", ret);
     }
 }
 
-pymargo_request pymargo_hg_handle::irespond(py11::bytes output)
+pymargo_request pymargo_hg_handle::irespond(const py11::object& output,
+                                            bool error)
 {
     hg_return_t ret;
     margo_request req;
+    pymargo_buffer_view view(output);
+    pymargo_output out = view.payload();
+    out.status = error ? 1 : 0;
     Py_BEGIN_ALLOW_THREADS
-    ret = margo_irespond(handle, &output, &req);
+    ret = margo_irespond(handle, &out, &req);
     Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_respond", ret);
@@ -571,15 +770,6 @@ pymargo_instance_id pymargo_hg_handle::_get_mid() const
     return MID2CAPSULE(margo_hg_handle_get_instance(handle));
 }
 
-#define CHECK_BUFFER_IS_CONTIGUOUS(__buf_info__) do { \
-    ssize_t __stride__ = (__buf_info__).itemsize;     \
-    for(ssize_t i=0; i < (__buf_info__).ndim; i++) {  \
-        if(__stride__ != (__buf_info__).strides[i])   \
-            throw std::invalid_argument("Non-contiguous arrays not yet supported by PyMargo"); \
-        __stride__ *= (__buf_info__).shape[i];        \
-    }                                                 \
-} while(0)
-
 static py11::str pymargo_get_config(pymargo_instance_id mid) {
     char* config = margo_get_config(mid);
     if(!config) return py11::str();
@@ -590,18 +780,82 @@ static py11::str pymargo_get_config(pymargo_instance_id mid) {
     }
 }
 
+/* Cap on the number of segments of a Bulk handle (see bulk.max_segments) */
+static const ssize_t pymargo_max_bulk_segments = 1024;
+
+/* Appends the memory of a buffer to the segments of a bulk handle.
+ * Non-contiguous (strided) buffers are decomposed into their largest
+ * contiguous blocks, i.e. the innermost dimensions whose elements are
+ * adjacent in memory. Segments that follow each other in memory are
+ * merged into one. Throws std::length_error (ValueError in Python) if
+ * the handle would exceed pymargo_max_bulk_segments segments. */
+static void pymargo_append_segments(
+        const py11::buffer_info& info,
+        std::vector<void*>& ptrs,
+        std::vector<hg_size_t>& sizes)
+{
+    ssize_t block = info.itemsize;
+    ssize_t outer = info.ndim;
+    while(outer > 0 && info.strides[outer-1] == block) {
+        block *= info.shape[outer-1];
+        outer -= 1;
+    }
+    ssize_t count = 1;
+    for(ssize_t i = 0; i < outer; i++) count *= info.shape[i];
+    if(block == 0 || count == 0) return;
+    if(static_cast<ssize_t>(ptrs.size()) + count > pymargo_max_bulk_segments) {
+        throw std::length_error("Cannot create a Bulk handle with more than "
+            + std::to_string(pymargo_max_bulk_segments) + " segments");
+    }
+
+    std::vector<ssize_t> index(outer, 0);
+    for(ssize_t n = 0; n < count; n++) {
+        ssize_t offset = 0;
+        for(ssize_t i = 0; i < outer; i++)
+            offset += index[i] * info.strides[i];
+        char* ptr = static_cast<char*>(info.ptr) + offset;
+        if(!ptrs.empty()
+        && static_cast<char*>(ptrs.back()) + sizes.back() == ptr) {
+            sizes.back() += block;
+        } else {
+            ptrs.push_back(ptr);
+            sizes.push_back(block);
+        }
+        for(ssize_t i = outer-1; i >= 0; i--) {
+            if(++index[i] < info.shape[i]) break;
+            index[i] = 0;
+        }
+    }
+}
+
 static pymargo_bulk pymargo_bulk_create(
         pymargo_instance_id mid,
-        const py11::buffer& data,
+        const py11::object& data,
         pymargo_bulk_access_mode flags)
 {
-    py11::buffer_info buf_info = data.request();
-    CHECK_BUFFER_IS_CONTIGUOUS(buf_info);
+    /* data is either a buffer-protocol object or a list (or tuple)
+     * of such objects, all exposed by a single hg_bulk_t */
+    std::vector<void*>     ptrs;
+    std::vector<hg_size_t> sizes;
+    if(py11::isinstance<py11::list>(data) || py11::isinstance<py11::tuple>(data)) {
+        for(auto item : data)
+            pymargo_append_segments(
+                item.cast<py11::buffer>().request(), ptrs, sizes);
+    } else {
+        pymargo_append_segments(
+            data.cast<py11::buffer>().request(), ptrs, sizes);
+    }
+    if(ptrs.empty()) {
+        throw std::invalid_argument("Cannot create a Bulk handle over empty memory");
+    }
 
-    hg_size_t size = buf_info.itemsize * buf_info.size;
-    void* buffer = const_cast<void*>(buf_info.ptr);
+    /* registering memory can be costly with RDMA transports */
     hg_bulk_t handle;
-    hg_return_t ret = margo_bulk_create(mid, 1, &buffer, &size, flags, &handle);
+    hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = margo_bulk_create(mid, ptrs.size(), ptrs.data(), sizes.data(),
+                            flags, &handle);
+    Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_create", ret);
     }
@@ -609,12 +863,19 @@ static pymargo_bulk pymargo_bulk_create(
 }
 
 static void pymargo_bulk_free(pymargo_bulk bulk) {
-    hg_return_t ret = margo_bulk_free(bulk);
+    hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = margo_bulk_free(bulk);
+    Py_END_ALLOW_THREADS
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_free", ret);
     }
 }
 
+static size_t pymargo_bulk_get_size(pymargo_bulk bulk) {
+    return margo_bulk_get_size(bulk);
+}
+
 static void pymargo_bulk_ref_incr(pymargo_bulk bulk) {
     hg_return_t ret = margo_bulk_ref_incr(bulk);
     if(ret != HG_SUCCESS) {
@@ -632,8 +893,11 @@ static void pymargo_bulk_transfer(
         size_t local_offset,
         size_t size) {
 
-    hg_return_t ret = margo_bulk_transfer(mid, static_cast<hg_bulk_op_t>(op), origin_addr,
+    hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = margo_bulk_transfer(mid, static_cast<hg_bulk_op_t>(op), origin_addr,
             origin_handle, origin_offset, local_handle, local_offset, size);
+    Py_END_ALLOW_THREADS
 
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_transfer", ret);
@@ -651,8 +915,11 @@ static pymargo_request pymargo_bulk_itransfer(
         size_t size) {
 
     margo_request req;
-    hg_return_t ret = margo_bulk_itransfer(mid, static_cast<hg_bulk_op_t>(op), origin_addr,
+    hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = margo_bulk_itransfer(mid, static_cast<hg_bulk_op_t>(op), origin_addr,
             origin_handle, origin_offset, local_handle, local_offset, size, &req);
+    Py_END_ALLOW_THREADS
 
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_itransfer", ret);
@@ -663,14 +930,21 @@ static pymargo_request pymargo_bulk_itransfer(
 static py11::bytes pymargo_bulk_to_str(
         pymargo_bulk handle, bool request_eager) {
 
+    // with request_eager, the content of read-only handles that are small
+    // enough is embedded in the serialized handle, so the receiver does
+    // not need an RDMA round trip to read it.
     hg_bool_t flag = request_eager ? HG_TRUE : HG_FALSE;
     hg_size_t buf_size = margo_bulk_get_serialize_size(handle, flag);
-    std::string raw_buf(buf_size, '\0');
-    hg_return_t ret = margo_bulk_serialize(const_cast<char*>(raw_buf.data()), buf_size, flag, handle);
+    // serialize directly into the bytes object instead of a temporary
+    PyObject* raw_buf = PyBytes_FromStringAndSize(nullptr, buf_size);
+    if(!raw_buf) throw py11::error_already_set();
+    auto result = py11::reinterpret_steal<py11::bytes>(raw_buf);
+    hg_return_t ret = margo_bulk_serialize(
+        PyBytes_AS_STRING(raw_buf), buf_size, flag, handle);
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_serialize", ret);
     }
-    return raw_buf;
+    return result;
 }
 
 static pymargo_bulk pymargo_str_to_bulk(
@@ -678,8 +952,13 @@ static pymargo_bulk pymargo_str_to_bulk(
         const py11::bytes& rep) {
 
     hg_bulk_t handle;
-    std::string str_rep = static_cast<std::string>(rep);
-    hg_return_t ret = margo_bulk_deserialize(mid, &handle, str_rep.data(), str_rep.size());
+    char* data = nullptr;
+    Py_ssize_t size = 0;
+    if(PyBytes_AsStringAndSize(rep.ptr(), &data, &size) != 0)
+        throw py11::error_already_set();
+    // eager data embedded by the sender is copied into the handle
+    // by margo_bulk_deserialize, pulling from it is then a local copy
+    hg_return_t ret = margo_bulk_deserialize(mid, &handle, data, size);
 
     if(ret != HG_SUCCESS) {
         throw pymargo_exception("margo_bulk_deserialize", ret);
@@ -688,6 +967,43 @@ static pymargo_bulk pymargo_str_to_bulk(
     return BULK2CAPSULE(handle);
 }
 
+static std::vector<margo_request> pymargo_request_list(const py11::list& reqs)
+{
+    std::vector<margo_request> result;
+    result.reserve(reqs.size());
+    for(auto r : reqs) {
+        if(r.is_none()) result.push_back(MARGO_REQUEST_NULL);
+        else result.push_back(CAPSULE2REQ(r.cast<pymargo_request>()));
+    }
+    return result;
+}
+
+static py11::tuple pymargo_request_wait_any(const py11::list& reqs)
+{
+    auto requests = pymargo_request_list(reqs);
+    size_t index = requests.size();
+    hg_return_t ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = margo_wait_any(requests.size(), requests.data(), &index);
+    Py_END_ALLOW_THREADS
+    return py11::make_tuple(index, static_cast<int>(ret));
+}
+
+static py11::list pymargo_request_wait_all(const py11::list& reqs)
+{
+    auto requests = pymargo_request_list(reqs);
+    std::vector<hg_return_t> rets(requests.size(), HG_SUCCESS);
+    Py_BEGIN_ALLOW_THREADS
+    for(size_t i = 0; i < requests.size(); i++) {
+        if(requests[i] == MARGO_REQUEST_NULL) continue;
+        rets[i] = margo_wait(requests[i]);
+    }
+    Py_END_ALLOW_THREADS
+    py11::list result;
+    for(auto ret : rets) result.append(static_cast<int>(ret));
+    return result;
+}
+
 static void pymargo_thread_sleep(
         pymargo_instance_id mid,
         double t) {
@@ -695,6 +1011,110 @@ static void pymargo_thread_sleep(
     margo_thread_sleep(mid, t);
 }
 
+///////////////////////////////////////////////////////////////////////////////////
+// Completion notifier
+///////////////////////////////////////////////////////////////////////////////////
+
+/* A notifier lets an external event loop (e.g. asyncio) be told when
+ * margo requests complete. For each watched request, a ULT is created in
+ * the progress pool that waits on the request, records its completion,
+ * and signals a file descriptor (an eventfd on Linux, a pipe elsewhere)
+ * that the event loop watches. No OS thread is blocked per request. */
+struct pymargo_notifier_state {
+
+    int read_fd  = -1;
+    int write_fd = -1;
+    std::mutex mutex;
+    std::vector<std::pair<uint64_t, hg_return_t>> completed;
+
+    ~pymargo_notifier_state() {
+        if(read_fd != -1) close(read_fd);
+        if(write_fd != -1 && write_fd != read_fd) close(write_fd);
+    }
+
+    void signal() {
+        uint64_t one = 1;
+        ssize_t n = write(write_fd, &one, sizeof(one));
+        (void)n;
+    }
+};
+
+struct pymargo_notifier_ult_args {
+    std::shared_ptr<pymargo_notifier_state> state;
+    margo_request                           req;
+    uint64_t                                token;
+};
+
+static void pymargo_notifier_ult(void* arg)
+{
+    auto args = static_cast<pymargo_notifier_ult_args*>(arg);
+    hg_return_t ret = margo_wait(args->req);
+    {
+        std::lock_guard<std::mutex> lock(args->state->mutex);
+        args->state->completed.emplace_back(args->token, ret);
+    }
+    args->state->signal();
+    delete args;
+}
+
+class pymargo_notifier {
+
+    std::shared_ptr<pymargo_notifier_state> state_m;
+
+    public:
+
+    pymargo_notifier()
+    : state_m(std::make_shared<pymargo_notifier_state>()) {
+#ifdef __linux__
+        int fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+        if(fd == -1) throw std::runtime_error("eventfd() failed");
+        state_m->read_fd  = fd;
+        state_m->write_fd = fd;
+#else
+        int fds[2];
+        if(pipe(fds) != 0) throw std::runtime_error("pipe() failed");
+        for(int i = 0; i < 2; i++) {
+            fcntl(fds[i], F_SETFL, fcntl(fds[i], F_GETFL) | O_NONBLOCK);
+            fcntl(fds[i], F_SETFD, FD_CLOEXEC);
+        }
+        state_m->read_fd  = fds[0];
+        state_m->write_fd = fds[1];
+#endif
+    }
+
+    pymargo_notifier(const pymargo_notifier&) = delete;
+
+    int fileno() const {
+        return state_m->read_fd;
+    }
+
+    void watch(pymargo_instance_id mid, pymargo_request req, uint64_t token) {
+        ABT_pool pool = ABT_POOL_NULL;
+        margo_get_progress_pool(CAPSULE2MID(mid), &pool);
+        auto args = new pymargo_notifier_ult_args{state_m, CAPSULE2REQ(req), token};
+        int ret = ABT_thread_create(pool, pymargo_notifier_ult, args,
+                                    ABT_THREAD_ATTR_NULL, NULL);
+        if(ret != ABT_SUCCESS) {
+            delete args;
+            throw pymargo_exception("ABT_thread_create", (hg_return_t)ret);
+        }
+    }
+
+    py11::list drain() {
+        uint64_t buf[64];
+        while(read(state_m->read_fd, buf, sizeof(buf)) > 0) {}
+        std::vector<std::pair<uint64_t, hg_return_t>> completed;
+        {
+            std::lock_guard<std::mutex> lock(state_m->mutex);
+            completed.swap(state_m->completed);
+        }
+        py11::list result;
+        for(const auto& c : completed)
+            result.append(py11::make_tuple(c.first, static_cast<int>(c.second)));
+        return result;
+    }
+};
+
 ///////////////////////////////////////////////////////////////////////////////////
 // ABT namespace
 ///////////////////////////////////////////////////////////////////////////////////
@@ -909,8 +1329,15 @@ PYBIND11_MODULE(_pymargo, m)
 //    py11::class_<pymargo_exception>(m, "MargoException")
 //        .def_readonly("code", &pymargo_exception::code);
     py11::register_exception<pymargo_exception>(m, "MargoException");
+    py11::register_exception<pymargo_remote_error>(m, "RemoteError");
+    m.attr("HG_TIMEOUT") = static_cast<int>(HG_TIMEOUT);
+    m.attr("max_bulk_segments") = pymargo_max_bulk_segments;
     m.def("request_wait", [](pymargo_request req) {
-        auto ret = margo_wait(req);
+        hg_return_t ret;
+        {
+            py11::gil_scoped_release release;
+            ret = margo_wait(req);
+        }
         if(ret != HG_SUCCESS) throw pymargo_exception("margo_wait", ret);
     });
     m.def("request_test", [](pymargo_request req) {
@@ -919,6 +1346,8 @@ PYBIND11_MODULE(_pymargo, m)
         if(ret != HG_SUCCESS) throw pymargo_exception("margo_test", (hg_return_t)ret);
         return static_cast<bool>(flag);
     });
+    m.def("request_wait_any", &pymargo_request_wait_any);
+    m.def("request_wait_all", &pymargo_request_wait_all);
 
     py11::enum_<margo_log_level>(m, "log_level")
         .value("external", MARGO_LOG_EXTERNAL)
@@ -964,21 +1393,34 @@ PYBIND11_MODULE(_pymargo, m)
         .value("push", PYMARGO_PUSH)
         .value("pull", PYMARGO_PULL)
         ;
-    py11::class_<pymargo_hg_handle>(m,"Handle")
+    py11::class_<pymargo_payload_view>(m, "PayloadView", py11::buffer_protocol())
+        .def_buffer([](pymargo_payload_view& v) -> py11::buffer_info {
+            return py11::buffer_info(
+                const_cast<char*>(v.data), 1,
+                py11::format_descriptor<uint8_t>::format(), 1,
+                { static_cast<ssize_t>(v.size) }, { 1 }, true);
+        });
+    py11::class_<pymargo_hg_handle>(m,"Handle", py11::dynamic_attr())
         .def("_get_hg_addr", &pymargo_hg_handle::_get_hg_addr)
         .def("get_id", &pymargo_hg_handle::get_id)
         .def("_forward", &pymargo_hg_handle::forward,
-             "provider_id"_a=0, "input"_a=py11::bytes(), "timeout"_a=0.0)
+             "provider_id"_a=0, "input"_a=py11::bytes(), "timeout"_a=0.0,
+             "as_memoryview"_a=false)
         .def("_iforward", &pymargo_hg_handle::iforward,
              "provider_id"_a=0, "input"_a=py11::bytes(), "timeout"_a=0.0)
-        .def("_get_output", &pymargo_hg_handle::_get_output)
-        .def("_respond", &pymargo_hg_handle::respond)
-        .def("_irespond", &pymargo_hg_handle::irespond)
+        .def("_get_output", &pymargo_hg_handle::_get_output,
+             "as_memoryview"_a=false)
+        .def("_respond", &pymargo_hg_handle::respond,
+             "output"_a, "error"_a=false)
+        .def("_irespond", &pymargo_hg_handle::irespond,
+             "output"_a, "error"_a=false)
         .def("_get_mid", &pymargo_hg_handle::_get_mid)
         ;
 
     m.def("init",                     &pymargo_init);
     m.def("finalize", [](pymargo_instance_id mid) {
+        /* finalize callbacks and in-flight handlers need the GIL */
+        py11::gil_scoped_release release;
         margo_finalize(mid);
     });
     m.def("wait_for_finalize",  [](pymargo_instance_id mid) {
@@ -999,7 +1441,10 @@ PYBIND11_MODULE(_pymargo, m)
             margo_shutdown_remote_instance(mid, addr);
     });
     m.def("get_config", pymargo_get_config);
-    m.def("register",                 &pymargo_register);
+    m.def("register",                 &pymargo_register,
+          "mid"_a, "rpc_name"_a, "provider_id"_a, "callable"_a,
+          "input_as_memoryview"_a=false, "pool"_a=py11::none());
+    m.def("find_pool",                &pymargo_find_pool);
     m.def("register_on_client",       &pymargo_register_on_client);
     m.def("registered",               &pymargo_registered);
     m.def("registered_provider",      &pymargo_provider_registered);
@@ -1018,6 +1463,7 @@ PYBIND11_MODULE(_pymargo, m)
     m.def("bulk_create",              &pymargo_bulk_create);
     m.def("bulk_free",                &pymargo_bulk_free);
     m.def("bulk_ref_incr",            &pymargo_bulk_ref_incr);
+    m.def("bulk_get_size",            &pymargo_bulk_get_size);
     m.def("bulk_transfer",            &pymargo_bulk_transfer);
     m.def("bulk_itransfer",           &pymargo_bulk_itransfer);
     m.def("bulk_to_str",              &pymargo_bulk_to_str);
@@ -1025,6 +1471,12 @@ PYBIND11_MODULE(_pymargo, m)
 
     m.def("sleep",                    &pymargo_thread_sleep);
 
+    py11::class_<pymargo_notifier>(m, "Notifier")
+        .def(py11::init<>())
+        .def("fileno", &pymargo_notifier::fileno)
+        .def("watch", &pymargo_notifier::watch, "mid"_a, "req"_a, "token"_a)
+        .def("drain", &pymargo_notifier::drain);
+
     // Inside abt package
     py11::module abt_package = m.def_submodule("abt");
     abt_package.def("_yield", &py_abt_yield);
@@ -0,0 +1,156 @@
+import unittest
+import asyncio
+import os
+import time
+from pymargo.core import Engine, MargoException, RemoteException, remote
+import pymargo.bulk
+
+
+class Receiver():
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def hello_world(self, handle, firstname, lastname):
+        handle.respond(f'Hello {firstname} {lastname}')
+
+    @remote
+    async def slow_hello(self, handle, name, delay):
+        await asyncio.sleep(delay)
+        handle.respond(f'Hello {name}')
+
+    @remote
+    async def async_fail(self, handle):
+        await asyncio.sleep(0)
+        raise KeyError('missing')
+
+
+class TestAsyncio(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        cls.engine = Engine(protocol, use_progress_thread=True,
+                            num_rpc_threads=2)
+        cls.receiver = Receiver(cls.engine)
+        cls.hello_world = cls.engine.register(
+            'hello_world', cls.receiver.hello_world)
+        cls.async_rpcs = cls.engine.register_provider(cls.receiver)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.finalize()
+
+    def test_acall(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.hello_world.on(engine.address)
+
+        async def run():
+            return await rpc.acall('Matthieu', lastname='Dorier')
+
+        resp = asyncio.run(run())
+        self.assertEqual(resp, 'Hello Matthieu Dorier')
+
+    def test_many_acalls(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.hello_world.on(engine.address)
+
+        async def run():
+            return await asyncio.gather(
+                *[rpc.acall(f'User{i}', lastname='Dorier')
+                  for i in range(256)])
+
+        resps = asyncio.run(run())
+        self.assertEqual(resps,
+                         [f'Hello User{i} Dorier' for i in range(256)])
+
+    def test_atransfer(self):
+        engine = TestAsyncio.engine
+        data = b'This is some bytes data'
+        local_data = bytearray(len(data))
+        remote_bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+        local_bulk = engine.create_bulk(local_data, pymargo.bulk.write_only)
+
+        async def run():
+            await engine.atransfer(pymargo.bulk.pull, engine.address,
+                                   remote_bulk, 0, local_bulk, 0, len(data))
+
+        asyncio.run(run())
+        self.assertEqual(bytes(local_data), data)
+
+    def test_cancelled_acall(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.async_rpcs['slow_hello'].on(engine.address)
+        pool = engine.handle_pool
+
+        async def run():
+            task = asyncio.ensure_future(rpc.acall('Matthieu', 0.2))
+            await asyncio.sleep(0.05)
+            idle = pool.idle
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # the handle goes back to the pool once the RPC completes
+            await asyncio.sleep(0.5)
+            return idle, pool.idle
+
+        before, after = asyncio.run(run())
+        self.assertEqual(after, before + 1)
+
+    def test_acall_timeout(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.async_rpcs['slow_hello'].on(engine.address)
+
+        async def run():
+            # the timeout is in milliseconds, as for blocking calls
+            return await rpc.acall('Matthieu', 0.5, timeout=50.0)
+
+        with self.assertRaises(TimeoutError):
+            asyncio.run(run())
+
+    def test_acall_without_progress_thread(self):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        engine = Engine(protocol)
+        try:
+            rpc = engine.register('hello_world',
+                                  TestAsyncio.receiver.hello_world)
+            callable_rpc = rpc.on(engine.address)
+            with self.assertRaises(MargoException):
+                asyncio.run(callable_rpc.acall('Matthieu',
+                                               lastname='Dorier'))
+            del callable_rpc
+        finally:
+            engine.finalize()
+
+    def test_async_handler(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.async_rpcs['slow_hello'].on(engine.address)
+        self.assertEqual(rpc('Matthieu', 0.0), 'Hello Matthieu')
+
+    def test_concurrent_async_handlers(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.async_rpcs['slow_hello'].on(engine.address)
+        count, delay = 1000, 0.5
+
+        async def run():
+            return await asyncio.gather(
+                *[rpc.acall(f'User{i}', delay) for i in range(count)])
+
+        start = time.monotonic()
+        resps = asyncio.run(run())
+        elapsed = time.monotonic() - start
+        self.assertEqual(resps, [f'Hello User{i}' for i in range(count)])
+        # the handlers are suspended concurrently on the engine's
+        # event loop instead of each holding an rpc thread
+        self.assertLess(elapsed, 10 * delay)
+
+    def test_async_handler_exception(self):
+        engine = TestAsyncio.engine
+        rpc = TestAsyncio.async_rpcs['async_fail'].on(engine.address)
+        with self.assertRaises(RemoteException) as ctx:
+            rpc()
+        self.assertEqual(ctx.exception.exception_type, 'KeyError')
+
+
+if __name__ == '__main__':
+    unittest.main()
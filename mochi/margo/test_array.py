@@ -0,0 +1,121 @@
+import unittest
+import os
+from pymargo.core import Engine
+from pymargo.array import RemoteArray
+import pymargo.bulk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Receiver():
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.pool = None
+
+    def total(self, handle, remote):
+        handle.respond(float(remote.array.sum()))
+
+    def copy(self, handle, remote):
+        handle.respond(numpy.asarray(remote).tolist())
+
+    def copy_into(self, handle, remote):
+        out = numpy.zeros(remote.shape, remote.dtype, order='F')
+        remote.materialize(out=out)
+        handle.respond(out.tolist())
+
+    def copy_into_strided(self, handle, remote):
+        shape = (remote.shape[0] * 3,) + remote.shape[1:]
+        out = numpy.zeros(shape, remote.dtype)[::3]
+        remote.materialize(out=out)
+        handle.respond(out.tolist())
+
+    def pooled_total(self, handle, remote):
+        array = remote.materialize(pool=self.pool)
+        in_use = self.pool.in_use
+        result = float(array.sum())
+        # the buffer cannot go back to the pool while the array exists
+        try:
+            remote.release()
+            refused = False
+        except BufferError:
+            refused = True
+        del array
+        remote.release()
+        handle.respond((result, in_use, refused, self.pool.in_use))
+
+
+@unittest.skipIf(numpy is None, 'requires numpy')
+class TestRemoteArray(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        cls.engine = Engine(protocol)
+        cls.receiver = Receiver(cls.engine)
+        cls.rpcs = {name: cls.engine.register(
+                        name, getattr(cls.receiver, name))
+                    for name in ['total', 'copy', 'copy_into',
+                                 'copy_into_strided', 'pooled_total']}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.finalize()
+
+    def rpc(self, name):
+        engine = TestRemoteArray.engine
+        return TestRemoteArray.rpcs[name].on(engine.address)
+
+    def test_payload_size(self):
+        array = numpy.arange(1 << 20, dtype=numpy.float64)
+        engine = TestRemoteArray.engine
+        rpc = self.rpc('total')
+        raw, _ = rpc._encode_input(engine.get_internal_mid(),
+                                   (RemoteArray(array),), {})
+        # only the dtype, shape and serialized Bulk travel in the request
+        self.assertLess(len(raw), 1024)
+        self.assertEqual(rpc(RemoteArray(array)), float(array.sum()))
+
+    def test_layouts(self):
+        base = numpy.arange(48, dtype=numpy.int32).reshape(6, 8)
+        for array in [base, numpy.asfortranarray(base), base[::2, 1::3]]:
+            self.assertEqual(self.rpc('copy')(RemoteArray(array)),
+                             array.tolist())
+
+    def test_materialize_into(self):
+        array = numpy.arange(24, dtype=numpy.float32).reshape(4, 6)
+        self.assertEqual(self.rpc('copy_into')(RemoteArray(array)),
+                         array.tolist())
+
+    def test_strided_staging(self):
+        count = 4 * pymargo.bulk.max_segments
+        # one segment per element, more than a Bulk handle may have
+        array = numpy.arange(count * 2, dtype=numpy.float64)[::2]
+        self.assertEqual(self.rpc('copy')(RemoteArray(array)),
+                         array.tolist())
+        self.assertEqual(self.rpc('copy_into_strided')(RemoteArray(array)),
+                         array.tolist())
+
+    def test_materialize_pooled(self):
+        engine = TestRemoteArray.engine
+        receiver = TestRemoteArray.receiver
+        receiver.pool = engine.buffer_pool(sizes=[4096], count=2)
+        try:
+            array = numpy.ones(256, dtype=numpy.float64)
+            self.assertEqual(self.rpc('pooled_total')(RemoteArray(array)),
+                             (256.0, 1, True, 0))
+        finally:
+            receiver.pool = None
+
+    def test_local_access(self):
+        array = numpy.arange(8)
+        remote = RemoteArray(array)
+        self.assertIs(remote.array, array)
+        self.assertEqual(remote.nbytes, array.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import time
+from pymargo.cache import LRU
+
+
+class TestLRU(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRU(maxsize=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', b'1')
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hit_ratio, 0.5)
+
+    def test_maxsize(self):
+        cache = LRU(maxsize=2)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        cache.get('a')
+        cache.put('c', b'3')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+
+    def test_max_bytes(self):
+        cache = LRU(max_bytes=10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        self.assertEqual(cache.nbytes, 10)
+        cache.put('c', b'123')
+        self.assertEqual(cache.nbytes, 8)
+        self.assertIsNone(cache.get('a'))
+        cache.put('d', b'x' * 11)
+        self.assertIsNone(cache.get('d'))
+
+    def test_ttl(self):
+        cache = LRU(ttl=0.05)
+        cache.put('a', b'1')
+        self.assertEqual(cache.get('a'), b'1')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = LRU()
+        cache.put(('x', 1), b'1')
+        cache.put(('x', 2), b'2')
+        cache.put(('y', 1), b'3')
+        self.assertTrue(cache.invalidate(('y', 1)))
+        self.assertFalse(cache.invalidate(('y', 1)))
+        self.assertEqual(cache.invalidate_if(lambda k: k[0] == 'x'), 2)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
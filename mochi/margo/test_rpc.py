@@ -1,13 +1,21 @@
 import unittest
 import os
-from pymargo.core import Engine, RemoteFunction, \
-                         CallableRemoteFunction, ForwardRequest
+import threading
+import time
+import tracemalloc
+import _pymargo
+from pymargo.core import Engine, RemoteFunction, remote, \
+                         CallableRemoteFunction, ForwardRequest, Request, \
+                         RemoteException, CompletedRequest
+from pymargo.serialization import StructCodec, loads
+from pymargo.cache import LRU
 
 
 class Receiver():
 
     def __init__(self, engine):
         self.engine = engine
+        self.lookups = 0
 
     def hello_world(self, handle, firstname, lastname):
         handle.respond(f'Hello {firstname} {lastname}')
@@ -17,6 +25,29 @@ class Receiver():
         req.test()
         req.wait()
 
+    def lookup(self, handle, key):
+        self.lookups += 1
+        handle.respond(key * 2)
+
+    def echo_arguments(self, handle, *args, **kwargs):
+        handle.respond((args, kwargs))
+
+    def fail(self, handle, message):
+        if message is None:
+            handle.respond('ok')
+            return
+        raise ValueError(message)
+
+
+@remote(codec='raw')
+def raw_reverse(handle, data):
+    handle.respond(bytes(data)[::-1])
+
+
+@remote(codec=StructCodec('<ii', '<q'))
+def struct_add(handle, a, b):
+    handle.respond(a + b)
+
 
 class TestRPC(unittest.TestCase):
 
@@ -31,6 +62,12 @@ class TestRPC(unittest.TestCase):
         cls.ihello_world = cls.engine.register(
             'ihello_world',
             cls.receiver.ihello_world)
+        cls.fail = cls.engine.register('fail', cls.receiver.fail)
+        cls.echo_arguments = cls.engine.register(
+            'echo_arguments', cls.receiver.echo_arguments)
+        cls.lookup_cache = LRU(maxsize=16)
+        cls.lookup = cls.engine.register('lookup', cls.receiver.lookup,
+                                         cache=cls.lookup_cache)
 
     @classmethod
     def tearDownClass(cls):
@@ -74,6 +111,427 @@ class TestRPC(unittest.TestCase):
         resp = rpc('Matthieu', lastname='Dorier')
         self.assertEqual(resp, 'Hello Matthieu Dorier')
 
+    def test_handle_pool_reuse(self):
+        engine = TestRPC.engine
+        hello_world = TestRPC.hello_world
+        addr = engine.address
+        hello_world.on(addr)('Matthieu', lastname='Dorier')
+        pool = engine.handle_pool
+        misses = pool.misses
+        for i in range(10):
+            resp = hello_world.on(addr)('Matthieu', lastname='Dorier')
+            self.assertEqual(resp, 'Hello Matthieu Dorier')
+        self.assertEqual(pool.misses, misses)
+
+    def test_handle_pool_in_wait_for_finalize(self):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        engine = Engine(protocol, use_progress_thread=True)
+        rpc = engine.register('hello_world', TestRPC.receiver.hello_world)
+        # a server typically blocks in wait_for_finalize right after its
+        # setup, handles must keep being pooled while it does
+        waiter = threading.Thread(target=engine.wait_for_finalize)
+        waiter.start()
+        time.sleep(0.1)
+        try:
+            for i in range(4):
+                resp = rpc.on(engine.address)('Matthieu', lastname='Dorier')
+                self.assertEqual(resp, 'Hello Matthieu Dorier')
+            self.assertGreaterEqual(engine.handle_pool.hits, 3)
+        finally:
+            engine.finalize()
+            waiter.join()
+        self.assertEqual(engine.handle_pool.idle, 0)
+
+    def test_concurrent_iforward(self):
+        engine = TestRPC.engine
+        hello_world = TestRPC.hello_world
+        addr = engine.address
+        rpc = hello_world.on(addr)
+        reqs = [rpc(f'User{i}', lastname='Dorier', blocking=False)
+                for i in range(8)]
+        for i, req in enumerate(reqs):
+            self.assertEqual(req.wait(), f'Hello User{i} Dorier')
+        self.assertGreaterEqual(engine.handle_pool.idle, 8)
+
+    def test_wait_any(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address)
+        reqs = [rpc(f'User{i}', lastname='Dorier', blocking=False)
+                for i in range(4)]
+        done = set()
+        for _ in range(4):
+            index, resp = Request.wait_any(reqs)
+            self.assertNotIn(index, done)
+            self.assertEqual(resp, f'Hello User{index} Dorier')
+            done.add(index)
+        self.assertEqual(Request.wait_any(reqs), (4, None))
+
+    def test_wait_all(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address)
+        reqs = [rpc(f'User{i}', lastname='Dorier', blocking=False)
+                for i in range(16)]
+        results = Request.wait_all(reqs)
+        self.assertEqual(results,
+                         [(i, f'Hello User{i} Dorier') for i in range(16)])
+        self.assertEqual(Request.wait_all(reqs), [])
+
+    def mixed_requests(self, rf):
+        engine = TestRPC.engine
+        rpc = rf.on(engine.address)
+        # fills the client cache
+        rpc('Cached', lastname='Dorier')
+        coalescer = TestRPC.hello_world.on(engine.address).coalesce(
+            max_count=8, max_delay=60.0)
+        reqs = [rpc('Forwarded', lastname='Dorier', blocking=False),
+                rpc('Cached', lastname='Dorier', blocking=False),
+                coalescer('Coalesced0', lastname='Dorier'),
+                coalescer('Coalesced1', lastname='Dorier')]
+        self.assertIsInstance(reqs[0], ForwardRequest)
+        self.assertIsInstance(reqs[1], CompletedRequest)
+        self.assertEqual(coalescer.batches, 0)
+        expected = [(0, 'Hello Forwarded Dorier'),
+                    (1, 'Hello Cached Dorier'),
+                    (2, 'Hello Coalesced0 Dorier'),
+                    (3, 'Hello Coalesced1 Dorier')]
+        return reqs, expected, coalescer
+
+    def test_wait_all_mixed_requests(self):
+        rf = TestRPC.engine.register('mixed_all', TestRPC.receiver.hello_world)
+        rf.enable_client_cache()
+        reqs, expected, coalescer = self.mixed_requests(rf)
+        self.assertEqual(Request.wait_all(reqs), expected)
+        # the batch was sent by wait_all
+        self.assertEqual(coalescer.batches, 1)
+        self.assertEqual(Request.wait_all(reqs), [])
+        rf.deregister()
+
+    def test_wait_any_mixed_requests(self):
+        rf = TestRPC.engine.register('mixed_any', TestRPC.receiver.hello_world)
+        rf.enable_client_cache()
+        reqs, expected, coalescer = self.mixed_requests(rf)
+        results = []
+        for _ in range(len(reqs)):
+            results.append(Request.wait_any(reqs))
+        self.assertEqual(sorted(results), expected)
+        self.assertEqual(coalescer.batches, 1)
+        self.assertEqual(Request.wait_any(reqs), (len(reqs), None))
+        rf.deregister()
+
+    def test_broadcast(self):
+        engine = TestRPC.engine
+        addresses = [engine.address for _ in range(8)]
+        resps = TestRPC.hello_world.broadcast(
+            addresses, 'Matthieu', lastname='Dorier')
+        self.assertEqual(resps, ['Hello Matthieu Dorier'] * 8)
+
+    def test_scatter(self):
+        engine = TestRPC.engine
+        addresses = [engine.address for _ in range(8)]
+        resps = TestRPC.hello_world.scatter(
+            addresses, [(f'User{i}',) for i in range(8)], lastname='Dorier')
+        self.assertEqual(resps, [f'Hello User{i} Dorier' for i in range(8)])
+        with self.assertRaises(ValueError):
+            TestRPC.hello_world.scatter(addresses, [])
+
+    def test_coalesce(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address).coalesce(
+            max_count=4, max_delay=60.0)
+        reqs = [rpc(f'User{i}', lastname='Dorier') for i in range(10)]
+        self.assertEqual(rpc.batches, 2)
+        for i, req in enumerate(reqs):
+            self.assertEqual(req.wait(), f'Hello User{i} Dorier')
+        self.assertEqual(rpc.batches, 3)
+        self.assertEqual(rpc.batched_calls, 10)
+        self.assertGreater(rpc.average_batch_size, 3.0)
+
+    def test_coalesce_concurrent_waits(self):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        # any thread can wait on requests of an Engine with a progress
+        # thread, without the main thread having to make progress
+        engine = Engine(protocol, use_progress_thread=True)
+        rpc = engine.register('hello_world', TestRPC.receiver.hello_world)
+        coalescer = rpc.on(engine.address).coalesce(max_count=8,
+                                                    max_delay=60.0)
+        try:
+            reqs = [coalescer(f'User{i}', lastname='Dorier')
+                    for i in range(2)]
+            results = [None, None]
+            barrier = threading.Barrier(2)
+
+            def waiter(index):
+                barrier.wait()
+                try:
+                    results[index] = reqs[index].wait()
+                except Exception as e:
+                    results[index] = e
+
+            threads = [threading.Thread(target=waiter, args=(i,))
+                       for i in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, ['Hello User0 Dorier',
+                                       'Hello User1 Dorier'])
+            self.assertEqual(coalescer.batches, 1)
+        finally:
+            engine.finalize()
+
+    def test_coalesce_timer(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address).coalesce(
+            max_count=8, max_delay=0.05)
+        req = rpc('Lone', lastname='Dorier')
+        time.sleep(0.5)
+        # the lone call was sent without anything waiting on it
+        self.assertEqual(rpc.batches, 1)
+        self.assertEqual(req.wait(), 'Hello Lone Dorier')
+
+    def test_coalesce_test(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address).coalesce(
+            max_count=8, max_delay=60.0)
+        req = rpc('Polled', lastname='Dorier')
+        self.assertEqual(rpc.batches, 0)
+        while not req.test():
+            engine.sleep(1)
+        self.assertEqual(rpc.batches, 1)
+        self.assertEqual(req.wait(), 'Hello Polled Dorier')
+
+    def test_coalesce_large_call(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.hello_world.on(engine.address).coalesce(max_size=64)
+        req = rpc('x' * 128, lastname='Dorier')
+        self.assertEqual(req.wait(), 'Hello ' + 'x' * 128 + ' Dorier')
+        self.assertEqual(rpc.direct_calls, 1)
+        self.assertEqual(rpc.batches, 0)
+
+    def test_server_cache(self):
+        engine = TestRPC.engine
+        receiver = TestRPC.receiver
+        cache = TestRPC.lookup_cache
+        rpc = TestRPC.lookup.on(engine.address)
+        lookups = receiver.lookups
+        self.assertEqual(rpc('a'), 'aa')
+        self.assertEqual(rpc('a'), 'aa')
+        self.assertEqual(receiver.lookups, lookups + 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(rpc('b'), 'bb')
+        self.assertEqual(receiver.lookups, lookups + 2)
+        self.assertEqual(TestRPC.lookup.invalidate_cache('a'), 1)
+        self.assertEqual(rpc('a'), 'aa')
+        self.assertEqual(receiver.lookups, lookups + 3)
+        self.assertEqual(TestRPC.lookup.invalidate_cache(), 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_client_cache(self):
+        engine = TestRPC.engine
+        calls = []
+
+        def versioned(handle, key):
+            calls.append(key)
+            handle.respond((key, len(calls)))
+
+        rf = engine.register('versioned', versioned)
+        cache = rf.enable_client_cache(ttl=0.2, stale_while_revalidate=True)
+        rpc = rf.on(engine.address)
+        self.assertEqual(rpc('a'), ('a', 1))
+        self.assertEqual(rpc('a'), ('a', 1))
+        self.assertEqual(rpc('a', blocking=False).wait(), ('a', 1))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.hits, 2)
+        time.sleep(0.3)
+        # the stale response is served while it is refreshed
+        self.assertEqual(rpc('a', blocking=False).wait(), ('a', 1))
+        rf._collect_revalidations(wait=True)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(rpc('a', blocking=False).wait(), ('a', 2))
+        self.assertEqual(cache.stale_hits, 1)
+        self.assertGreater(cache.hit_ratio, 0.5)
+        rf.disable_client_cache()
+        self.assertEqual(rpc('a'), ('a', 3))
+        rf.deregister()
+
+    def test_singleflight(self):
+        engine = TestRPC.engine
+        calls = []
+
+        @remote(singleflight=True)
+        def fetch(handle, key):
+            calls.append(key)
+            # keeps the flight open while the other requests arrive
+            engine.sleep(200)
+            handle.respond(key.upper())
+
+        rf = engine.register('fetch', fetch)
+        rpc = rf.on(engine.address)
+        reqs = [rpc('x', blocking=False) for i in range(16)]
+        reqs.append(rpc('y', blocking=False))
+        results = [req.wait() for req in reqs]
+        self.assertEqual(results, ['X'] * 16 + ['Y'])
+        self.assertEqual(calls.count('x'), 1)
+        self.assertEqual(calls.count('y'), 1)
+        # once answered, a new request runs the handler again
+        self.assertEqual(rpc('x'), 'X')
+        self.assertEqual(calls.count('x'), 2)
+        rf.deregister()
+
+    def test_singleflight_deferred_response(self):
+        engine = TestRPC.engine
+        pending = []
+
+        @remote(singleflight=True)
+        def defer(handle, key):
+            # responded to after the handler has returned
+            pending.append(handle)
+
+        def wait_pending(count):
+            deadline = time.monotonic() + 5.0
+            while len(pending) < count and time.monotonic() < deadline:
+                engine.sleep(1)
+            self.assertEqual(len(pending), count)
+
+        rf = engine.register('defer', defer)
+        rpc = rf.on(engine.address)
+        first = rpc('x', blocking=False)
+        wait_pending(1)
+        # the flight ended when the handler returned
+        second = rpc('x', blocking=False)
+        wait_pending(2)
+        for handle in pending:
+            handle.respond(handle is pending[0])
+        self.assertEqual([first.wait(), second.wait()], [True, False])
+        rf.deregister()
+
+    def test_argument_packing(self):
+        engine = TestRPC.engine
+        mid = engine.get_internal_mid()
+        rpc = TestRPC.echo_arguments.on(engine.address)
+        for args, kwargs, packed in [
+                ((), {}, ()),
+                ((1, 'a'), {}, (1, 'a')),
+                ((), {'x': 1}, {'args': (), 'kwargs': {'x': 1}}),
+                ((1,), {'y': 'a'}, {'args': (1,), 'kwargs': {'y': 'a'}})]:
+            # calls without keyword arguments send the bare args tuple
+            raw_data, _ = rpc._encode_input(mid, args, kwargs)
+            self.assertEqual(loads(mid, raw_data), packed)
+            self.assertEqual(rpc(*args, **kwargs), (args, kwargs))
+
+    def test_remote_exception(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.fail.on(engine.address)
+        with self.assertRaises(RemoteException) as ctx:
+            rpc('something went wrong')
+        self.assertEqual(ctx.exception.exception_type, 'ValueError')
+        self.assertEqual(ctx.exception.message, 'something went wrong')
+        self.assertIn('raise ValueError', ctx.exception.remote_traceback)
+        req = rpc('again', blocking=False)
+        with self.assertRaises(RemoteException):
+            req.wait()
+        # the handle is still usable after an error
+        self.assertEqual(rpc(None), 'ok')
+
+    def test_unencodable_output(self):
+        engine = TestRPC.engine
+
+        def respond_lock(handle):
+            handle.respond(threading.Lock())
+
+        rf = engine.register('respond_lock', respond_lock)
+        with self.assertRaises(RemoteException) as ctx:
+            rf.on(engine.address)()
+        self.assertEqual(ctx.exception.exception_type, 'TypeError')
+        rf.deregister()
+
+    def test_remote_exception_in_batch(self):
+        engine = TestRPC.engine
+        rpc = TestRPC.fail.on(engine.address).coalesce(max_delay=60.0)
+        reqs = [rpc(None), rpc('batched error'), rpc(None)]
+        self.assertEqual(reqs[0].wait(), 'ok')
+        with self.assertRaises(RemoteException) as ctx:
+            reqs[1].wait()
+        self.assertEqual(ctx.exception.message, 'batched error')
+        self.assertEqual(reqs[2].wait(), 'ok')
+
+    def test_forward_buffer(self):
+        engine = TestRPC.engine
+
+        def raw_echo(handle, raw_input):
+            handle._respond(bytearray(raw_input[::-1]))
+
+        rpc_id = _pymargo.register(engine.mid, 'raw_echo', 0, raw_echo)
+        handle = _pymargo.create(engine.mid, engine.address.hg_addr, rpc_id)
+        for payload in [b'abc', bytearray(b'abc'), memoryview(b'xabc')[1:]]:
+            self.assertEqual(handle._forward(input=payload), b'cba')
+        with self.assertRaises(BufferError):
+            handle._forward(input=memoryview(b'abcdef')[::2])
+        del handle
+        _pymargo.deregister(engine.mid, rpc_id)
+
+    def test_memoryview_payloads(self):
+        engine = TestRPC.engine
+        received = []
+
+        def raw_view_echo(handle, raw_input):
+            received.append(type(raw_input))
+            self.assertTrue(raw_input.readonly)
+            handle._respond(raw_input)
+
+        rpc_id = _pymargo.register(engine.mid, 'raw_view_echo', 0,
+                                   raw_view_echo, input_as_memoryview=True)
+        handle = _pymargo.create(engine.mid, engine.address.hg_addr, rpc_id)
+        out = handle._forward(input=b'abcdef', as_memoryview=True)
+        self.assertEqual(received, [memoryview])
+        self.assertIsInstance(out, memoryview)
+        self.assertTrue(out.readonly)
+        self.assertEqual(out.tobytes(), b'abcdef')
+        out.release()
+        self.assertEqual(handle._forward(input=b'ghi'), b'ghi')
+        del handle
+        _pymargo.deregister(engine.mid, rpc_id)
+
+    def test_forward_buffer_copies(self):
+        engine = TestRPC.engine
+        size = 1024 * 1024
+
+        def raw_sink(handle, raw_input):
+            handle._respond(b'')
+
+        # the input is decoded in place on the server side, so that the
+        # only traced allocations are those of the client's forward
+        rpc_id = _pymargo.register(engine.mid, 'raw_sink', 0, raw_sink,
+                                   input_as_memoryview=True)
+        handle = _pymargo.create(engine.mid, engine.address.hg_addr, rpc_id)
+        payload = bytearray(size)
+
+        def peak_forward(handle, payload):
+            tracemalloc.start()
+            handle._forward(input=payload)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return peak
+
+        # the payload is encoded without any copy
+        self.assertLess(peak_forward(handle, payload), size // 4)
+        del handle
+        _pymargo.deregister(engine.mid, rpc_id)
+
+    def test_codecs(self):
+        engine = TestRPC.engine
+        addr = engine.address
+        reverse = engine.register(func=raw_reverse)
+        self.assertEqual(reverse.on(addr)(bytearray(b'abc')), b'cba')
+        req = reverse.on(addr)(b'defg', blocking=False)
+        self.assertEqual(req.wait(), b'gfed')
+        with self.assertRaises(TypeError):
+            reverse.on(addr)(b'abc', b'def')
+        add = engine.register(func=struct_add)
+        self.assertEqual(add.on(addr)(40, 2), 42)
+        with self.assertRaises(ValueError):
+            add.on(addr).coalesce()
+
     def test_deregister(self):
         engine = TestRPC.engine
         receiver = Receiver(engine)
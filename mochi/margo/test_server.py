@@ -1,6 +1,7 @@
 import unittest
 import os
-from pymargo.core import Engine, on_finalize, on_prefinalize
+import _pymargo
+from pymargo.core import Engine, on_finalize, on_prefinalize, remote
 
 
 class MyProvider:
@@ -18,6 +19,17 @@ class MyProvider:
         self._on_prefinalize_called = True
 
 
+class PooledProvider:
+
+    @remote(pool='heavy_pool')
+    def heavy(self, handle):
+        handle.respond('heavy')
+
+    @remote
+    def light(self, handle):
+        handle.respond('light')
+
+
 class TestInitEngine(unittest.TestCase):
 
     def test_init_engine(self):
@@ -44,6 +56,30 @@ class TestInitEngine(unittest.TestCase):
         self.assertIn('argobots', config)
         engine.finalize()
 
+    def test_register_with_pool(self):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        config = {
+            'argobots': {
+                'pools': [{'name': 'heavy_pool', 'access': 'mpmc'}],
+                'xstreams': [{
+                    'name': 'heavy_es',
+                    'scheduler': {'type': 'basic_wait',
+                                  'pools': ['heavy_pool']}
+                }]
+            }
+        }
+        engine = Engine(protocol, config=config)
+        rpcs = engine.register_provider(PooledProvider())
+        self.assertEqual(rpcs['heavy'].on(engine.address)(), 'heavy')
+        self.assertEqual(rpcs['light'].on(engine.address)(), 'light')
+        self.assertNotIn('rpc_pools', engine.config)
+        pools = engine.rpc_pools
+        self.assertEqual(pools, [{'name': 'heavy', 'provider_id': 0,
+                                  'pool': 'heavy_pool'}])
+        with self.assertRaises(_pymargo.MargoException):
+            engine.register('other', lambda h: None, pool='unknown_pool')
+        engine.finalize()
+
     def test_init_engine_fail(self):
         with self.assertRaises(RuntimeError):
             Engine('abc')
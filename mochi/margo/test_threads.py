@@ -0,0 +1,81 @@
+import unittest
+import os
+import threading
+from pymargo.core import Engine
+import pymargo.bulk
+
+
+class Receiver():
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.in_transfer = 0
+        self.max_in_transfer = 0
+
+    def pull(self, handle, bulk, size):
+        local_data = bytearray(size)
+        local_bulk = self.engine.create_bulk(
+            local_data, pymargo.bulk.write_only)
+        with self.lock:
+            self.in_transfer += 1
+            self.max_in_transfer = max(self.max_in_transfer,
+                                       self.in_transfer)
+        try:
+            self.engine.transfer(pymargo.bulk.pull, handle.address, bulk, 0,
+                                 local_bulk, 0, size)
+        finally:
+            with self.lock:
+                self.in_transfer -= 1
+        handle.respond(local_data[-1])
+
+
+class TestThreads(unittest.TestCase):
+
+    size = 1024 * 1024
+    num_threads = 8
+    calls_per_thread = 32
+
+    @classmethod
+    def setUpClass(cls):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        cls.engine = Engine(protocol, use_progress_thread=True,
+                            num_rpc_threads=4)
+        cls.receiver = Receiver(cls.engine)
+        cls.pull = cls.engine.register('pull', cls.receiver.pull)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.finalize()
+
+    def test_concurrent_transfers(self):
+        # blocking margo calls (bulk transfers, waits, lookups) release
+        # the GIL, so the transfers of concurrent handlers overlap
+        # instead of serializing on the interpreter
+        engine = TestThreads.engine
+        errors = []
+
+        def client(index):
+            try:
+                # a handle must not be forwarded by several
+                # threads at once, each thread uses its own
+                rpc = TestThreads.pull.on(engine.address)
+                data = bytes([index % 256]) * self.size
+                bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+                for i in range(self.calls_per_thread):
+                    self.assertEqual(rpc(bulk, self.size), index % 256)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=client, args=(i,))
+                   for i in range(self.num_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(TestThreads.receiver.max_in_transfer, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# (C) 2022 The University of Chicago
+# See COPYRIGHT in top-level directory.
+
+"""
+Integration of margo requests with asyncio event loops.
+
+Each event loop gets a native notifier whose file descriptor is watched
+by the loop. Awaiting a margo request spawns a ULT in the Engine's
+progress pool that waits for the request and signals the notifier, so
+no OS thread is blocked and no polling takes place. Since progress has
+to be made while the event loop runs, the Engine must have been
+created with use_progress_thread=True (and with num_rpc_threads > 0
+if it also serves the RPCs it sends from the event loop's thread).
+
+This module also provides the event loop on which an Engine runs its
+async def RPC handlers (see EventLoopThread).
+"""
+
+import _pymargo
+import asyncio
+import concurrent.futures
+import threading
+import weakref
+from typing import Any, Coroutine, Dict, Set
+from .typing import margo_instance_id, margo_request
+
+
+class _LoopNotifier:
+    """
+    Maps the completions reported by a native Notifier
+    to futures of a given event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._notifier = _pymargo.Notifier()
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._next_token = 0
+        loop.add_reader(self._notifier.fileno(), self._on_ready)
+
+    def watch(self, mid: margo_instance_id,
+              req: margo_request) -> asyncio.Future:
+        token = self._next_token
+        self._next_token += 1
+        future = self._loop.create_future()
+        self._futures[token] = future
+        try:
+            self._notifier.watch(mid, req, token)
+        except BaseException:
+            del self._futures[token]
+            raise
+        return future
+
+    def _on_ready(self) -> None:
+        for token, ret in self._notifier.drain():
+            future = self._futures.pop(token)
+            if future.cancelled():
+                continue
+            if ret == 0:
+                future.set_result(None)
+            elif ret == _pymargo.HG_TIMEOUT:
+                # same error as Request.wait
+                future.set_exception(TimeoutError("Margo forward timed out"))
+            else:
+                future.set_exception(_pymargo.MargoException(
+                    f"margo_wait() returned {ret}"))
+
+
+_notifiers = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+def wait_request(mid: margo_instance_id,
+                 req: margo_request) -> asyncio.Future:
+    """
+    Returns a future of the running event loop that completes when
+    the request does. The request is consumed and must not be waited
+    on by any other means.
+    """
+    loop = asyncio.get_running_loop()
+    notifier = _notifiers.get(loop)
+    if notifier is None:
+        notifier = _LoopNotifier(loop)
+        _notifiers[loop] = notifier
+    return notifier.watch(mid, req)
+
+
+_background: Set[asyncio.Future] = set()
+
+
+def _background_done(mid: margo_instance_id, future: asyncio.Future) -> None:
+    _background.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        _pymargo.error(f'Background margo request failed with '
+                       f'{future.exception()!r}', mid=mid)
+
+
+def wait_request_in_background(mid: margo_instance_id,
+                               req: margo_request) -> None:
+    """
+    Waits for the request from the running event loop without
+    awaiting it. Errors are reported through the margo logger.
+    """
+    future = wait_request(mid, req)
+    _background.add(future)
+    future.add_done_callback(lambda f: _background_done(mid, f))
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in its own daemon thread, on which
+    an Engine runs the coroutines of its async def RPC handlers.
+    Suspended coroutines hold neither a ULT nor an execution stream.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name='pymargo-event-loop', daemon=True)
+        self._thread.start()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) \
+            -> concurrent.futures.Future:
+        """
+        Schedules the coroutine on the event loop, from any thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self) -> None:
+        """
+        Stops the event loop, cancelling the coroutines still
+        running on it, and closes it.
+        """
+        if self._loop.is_closed():
+            return
+        if threading.current_thread() is self._thread:
+            self._loop.stop()
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
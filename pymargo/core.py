@@ -1,13 +1,25 @@
 # (C) 2018 The University of Chicago
 # See COPYRIGHT in top-level directory.
 import _pymargo
+import asyncio
+import os
 import types
 import json
-from typing import Type, Callable, Any, List, Mapping, Union, Optional
+import functools
+import time
+import threading
+import traceback
+import weakref
+from collections import deque
+from typing import Type, Callable, Any, List, Mapping, Union, Optional, \
+                   Deque, Dict, Tuple, Sequence, Coroutine, Hashable
 from .typing import hg_addr_t, margo_instance_id, margo_request
-from .bulk import Bulk
+from .bulk import Bulk, BufferPool, FileBulk, _staged
 from .logging import Logger
-from .serialization import loads, dumps
+from .cache import LRU
+from .serialization import loads, dumps, Codec, PickleCodec, get_codec, \
+    _pack_arguments, _unpack_arguments
+from .aio import wait_request, wait_request_in_background, EventLoopThread
 
 
 """
@@ -29,6 +41,51 @@ Exception raised by most of the pymargo C++ functions.
 MargoException = _pymargo.MargoException
 
 
+class RemoteException(Exception):
+    """
+    Exception raised when the handler of an RPC raised an exception.
+    exception_type and message describe the exception raised remotely,
+    remote_traceback is its formatted traceback if the server sent it.
+    """
+
+    def __init__(self, exception_type: str, message: str,
+                 remote_traceback: Optional[str] = None):
+        super().__init__(exception_type, message, remote_traceback)
+        self.exception_type = exception_type
+        self.message = message
+        self.remote_traceback = remote_traceback
+
+    def __str__(self) -> str:
+        text = f'{self.exception_type}: {self.message}'
+        if self.remote_traceback:
+            text += '\n\nRemote traceback:\n' + self.remote_traceback
+        return text
+
+    @staticmethod
+    def _from_envelope(envelope: str) -> 'RemoteException':
+        content = json.loads(envelope)
+        return RemoteException(content['type'], content['message'],
+                               content.get('traceback'))
+
+
+def _error_envelope(error: Exception, with_traceback: bool) -> str:
+    """
+    Serializes an exception raised by an RPC handler so that
+    it can be sent back to the client as a RemoteException.
+    """
+    cls = type(error)
+    type_name = cls.__qualname__
+    if cls.__module__ != 'builtins':
+        type_name = f'{cls.__module__}.{type_name}'
+    content = {
+        'type': type_name,
+        'message': str(error),
+        'traceback': ''.join(traceback.format_exception(
+            cls, error, error.__traceback__)) if with_traceback else None
+    }
+    return json.dumps(content)
+
+
 class Address:
     """
     Address class, represents the network address of an Engine.
@@ -45,6 +102,7 @@ class Address:
         self._mid = mid
         self._hg_addr = hg_addr
         self._need_del = need_del
+        self._str: Optional[str] = None
 
     def __del__(self) -> None:
         """
@@ -59,7 +117,9 @@ class Address:
         on addresses returned by Engine.get_addr(), not on client addresses
         retrieved from RPC handles.
         """
-        return _pymargo.addr2str(self._mid, self._hg_addr)
+        if self._str is None:
+            self._str = _pymargo.addr2str(self._mid, self._hg_addr)
+        return self._str
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -99,21 +159,158 @@ class Request:
     Generic Request wrapper for non-blocking operations.
     """
 
-    def __init__(self, req: margo_request):
+    def __init__(self, req: margo_request,
+                 mid: Optional[margo_instance_id] = None):
         self._req = req
+        self._mid = mid
+        # status of the native request once completed
+        # by wait_any or wait_all, until the request is waited on
+        self._ret: Optional[int] = None
 
     def wait(self):
         """
         Wait for the request to complete.
         """
-        _pymargo.request_wait(self._req)
+        self._wait_native()
+        return self._complete()
+
+    async def async_wait(self):
+        """
+        Wait for the request to complete without blocking
+        the running asyncio event loop. The Engine must use
+        a progress thread.
+        """
+        if self._ret is not None:
+            return self.wait()
+        if self._mid is None:
+            raise MargoException(
+                "Request cannot be awaited: no margo instance attached")
+        await wait_request(self._mid, self._take_req())
+        return self._complete()
 
     def test(self):
         """
         Test if the request has completed.
         """
+        if self._req is None:
+            return True
         return _pymargo.request_test(self._req)
 
+    @staticmethod
+    def wait_any(requests: Sequence['Request']) -> Tuple[int, Any]:
+        """
+        Waits for any of the pending requests in the list to complete,
+        in a single native call. Returns the index of the completed
+        request along with its output (the decoded output of the RPC
+        for a ForwardRequest, None for other requests). Requests that
+        are already complete (e.g. responses served by a client cache)
+        are returned first, and the batches of coalesced calls are sent.
+        If no request is pending, returns (len(requests), None).
+        """
+        candidates = [i for i, r in enumerate(requests) if not r._consumed()]
+        owners: List[Request] = []
+        for i in candidates:
+            owner = requests[i]._pending()
+            if owner is None:
+                return i, requests[i].wait()
+            if all(owner is not o for o in owners):
+                owners.append(owner)
+        if not owners:
+            return len(requests), None
+        index, ret = _pymargo.request_wait_any([o._req for o in owners])
+        owners[index]._settle(ret)
+        for i in candidates:
+            if requests[i]._pending() is None:
+                return i, requests[i].wait()
+        raise MargoException("margo_wait_any() completed no request")
+
+    @staticmethod
+    def wait_all(requests: Sequence['Request'],
+                 return_exceptions: bool = False) -> List[Tuple[int, Any]]:
+        """
+        Waits for all the pending requests in the list to complete,
+        in a single native call. Returns a list of (index, output) pairs
+        for the requests whose output had not been returned yet, in the
+        order of the list, including requests that were already complete
+        (the batches of coalesced calls are sent). If return_exceptions
+        is False, the first error is raised once all the requests have
+        completed, otherwise exceptions are returned in place of the
+        corresponding outputs.
+        """
+        candidates = [i for i, r in enumerate(requests) if not r._consumed()]
+        owners: List[Request] = []
+        for i in candidates:
+            owner = requests[i]._pending()
+            if owner is not None and all(owner is not o for o in owners):
+                owners.append(owner)
+        rets = _pymargo.request_wait_all([o._req for o in owners])
+        for owner, ret in zip(owners, rets):
+            owner._settle(ret)
+        results: List[Tuple[int, Any]] = []
+        error: Optional[Exception] = None
+        for i in candidates:
+            try:
+                results.append((i, requests[i].wait()))
+            except Exception as e:
+                if not return_exceptions:
+                    error = error or e
+                results.append((i, e))
+        if error is not None:
+            raise error
+        return results
+
+    def _pending(self) -> Optional['Request']:
+        """
+        Returns the Request holding the native request that must
+        complete before this one can (the request itself, or the
+        request of its batch for a CoalescedRequest), or None if
+        waiting on this one would not block.
+        """
+        return self if self._req is not None else None
+
+    def _consumed(self) -> bool:
+        """
+        Whether the output of the request was already returned.
+        """
+        return self._req is None and self._ret is None
+
+    def _settle(self, ret: int) -> None:
+        """
+        Records the status of the native request, completed by
+        wait_any or wait_all, for the next call to wait.
+        """
+        self._req = None
+        self._ret = ret
+
+    def _wait_native(self) -> None:
+        """
+        Waits for the native request, unless wait_any or
+        wait_all already did, and checks its status.
+        """
+        if self._ret is not None:
+            ret = self._ret
+            self._ret = None
+            self._check(ret)
+        else:
+            _pymargo.request_wait(self._take_req())
+
+    def _take_req(self) -> margo_request:
+        if self._req is None:
+            raise MargoException("Request already waited on")
+        req = self._req
+        self._req = None
+        return req
+
+    @staticmethod
+    def _check(ret: int) -> None:
+        if ret == _pymargo.HG_TIMEOUT:
+            raise TimeoutError("Margo forward timed out")
+        if ret != 0:
+            raise MargoException(f"margo_wait() returned {ret}")
+
+    def _complete(self) -> Any:
+        return None
+
 
 class ForwardRequest(Request):
     """
@@ -122,24 +319,244 @@ class ForwardRequest(Request):
     """
 
     def __init__(self, req: margo_request,
-                 handle: _pymargo.Handle):
-        super().__init__(req)
+                 handle: _pymargo.Handle,
+                 release: Optional[Callable[[_pymargo.Handle], None]] = None,
+                 mid: Optional[margo_instance_id] = None,
+                 codec: Optional[Codec] = None,
+                 keepalive: Any = None,
+                 cache_entry: Optional[Tuple[LRU, Hashable]] = None):
+        super().__init__(req, mid if mid is not None else handle._get_mid())
         self._handle = handle
+        self._release = release
+        self._codec = codec if codec is not None else get_codec()
+        # objects (e.g. out-of-band Bulk handles) that must
+        # stay alive until the response has been received
+        self._keepalive = keepalive
+        # client cache and key in which to store the raw response
+        self._cache_entry = cache_entry
 
     def wait(self):
         """
         Wait for the request to complete and return
         the output of the RPC.
         """
-        if self._handle is None:
-            raise MargoException("Request already waited on")
-        super().wait()
-        raw_output = self._handle._get_output()
-        if raw_output is None:
-            return None
-        mid = self._handle._get_mid()
+        return super().wait()
+
+    async def async_wait(self):
+        """
+        Wait for the request to complete without blocking the
+        running asyncio event loop, and return the output of the RPC.
+        The Engine must use a progress thread. If the waiting coroutine
+        is cancelled, the handle is given back once the RPC completes.
+        """
+        if self._ret is not None:
+            return self.wait()
+        future = wait_request(self._mid, self._take_req())
+        try:
+            # shielded so that cancelling the caller does not cancel
+            # the notification of the completion of the forward
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(self._abandoned)
+            raise
+        except BaseException:
+            self._discard(reuse=False)
+            raise
+        return self._complete()
+
+    def _abandoned(self, future: asyncio.Future) -> None:
+        """
+        Called when the forward of a cancelled async_wait completes.
+        """
+        reuse = not future.cancelled() and future.exception() is None
+        self._discard(reuse)
+
+    def _discard(self, reuse: bool) -> None:
+        """
+        Drops the handle without reading the output, giving it back
+        to the HandlePool if reuse is True and it was pooled.
+        """
+        handle = self._handle
+        self._handle = None
+        self._keepalive = None
+        if handle is not None and reuse and self._release is not None:
+            self._release(handle)
+
+    def _complete(self) -> Any:
+        handle = self._handle
         self._handle = None
-        return loads(mid, raw_output)  # type: ignore
+        self._keepalive = None
+        try:
+            # the output is decoded in place, the handle can be
+            # reused only once the view over it has been released
+            raw_output = handle._get_output(as_memoryview=True)
+            if raw_output is None:
+                return None
+            with raw_output:
+                if self._cache_entry is not None:
+                    cache, key = self._cache_entry
+                    cache.put(key, bytes(raw_output))
+                return self._codec.decode_output(self._mid, raw_output)
+        except _pymargo.RemoteError as e:
+            raise RemoteException._from_envelope(str(e)) from None
+        finally:
+            if self._release is not None:
+                self._release(handle)
+
+
+class CompletedRequest(Request):
+    """
+    A CompletedRequest is a Request that completed as soon as it was
+    created, for operations that did not need to go through Mercury.
+    """
+
+    def __init__(self, output: Any = None):
+        super().__init__(None)
+        self._output = output
+        self._taken = False
+
+    def wait(self):
+        """
+        Returns the output of the operation.
+        """
+        self._taken = True
+        return self._output
+
+    async def async_wait(self):
+        """
+        Returns the output of the operation.
+        """
+        return self.wait()
+
+    def _consumed(self) -> bool:
+        return self._taken
+
+    def _complete(self) -> Any:
+        return self._output
+
+
+class _ResponseRequest(Request):
+    """
+    Request of a non-blocking response of the leader of a singleflight,
+    which completes once the same response, sent to the waiting
+    requests, has completed as well.
+    """
+
+    def __init__(self, req: margo_request, mid: margo_instance_id,
+                 followers: List[Request]):
+        super().__init__(req, mid)
+        self._followers = followers
+
+    def test(self):
+        return super().test() and all(f.test() for f in self._followers)
+
+    def _complete(self) -> Any:
+        followers = self._followers
+        self._followers = []
+        Request.wait_all(followers)
+        return None
+
+
+class HandlePool:
+    """
+    A HandlePool keeps idle RPC handles, keyed by target address
+    and RPC id, so that they can be reused across calls instead of
+    being created and destroyed for every request. Margo re-targets
+    a handle to the requested provider id on each forward, so a handle
+    coming back to the pool only needs its output to have been freed.
+    """
+
+    def __init__(self, engine: 'Engine', max_idle: int = 16):
+        """
+        Constructor. This method is not supposed to be called
+        directly by users. Each Engine owns a HandlePool,
+        accessible via Engine.handle_pool.
+        max_idle : maximum number of idle handles kept per key
+        """
+        self._engine = engine
+        self._max_idle = max_idle
+        self._idle: Dict[Tuple[str, int], Deque[_pymargo.Handle]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._closed = False
+
+    def acquire(self, address: Address, rpc_id: int) -> _pymargo.Handle:
+        """
+        Returns an idle handle for the given address and RPC id,
+        creating a new one if none is available.
+        """
+        key = self._key(address, rpc_id)
+        idle = self._idle.get(key) if key is not None else None
+        if idle:
+            try:
+                handle = idle.pop()
+                self._hits += 1
+                return handle
+            except IndexError:
+                pass
+        self._misses += 1
+        return _pymargo.create(self._engine.mid, address.hg_addr, rpc_id)
+
+    def release(self, address: Address, rpc_id: int,
+                handle: _pymargo.Handle) -> None:
+        """
+        Gives a handle that is no longer in use back to the pool.
+        The handle must not have an operation in flight.
+        """
+        if self._closed:
+            return
+        key = self._key(address, rpc_id)
+        if key is None:
+            return
+        idle = self._idle.get(key)
+        if idle is None:
+            idle = self._idle.setdefault(key, deque())
+        if len(idle) < self._max_idle:
+            idle.append(handle)
+
+    @staticmethod
+    def _key(address: Address, rpc_id: int) -> Optional[Tuple[str, int]]:
+        try:
+            return (str(address), rpc_id)
+        except MargoException:
+            # some transports cannot convert client addresses into
+            # strings, handles to such addresses are not pooled
+            return None
+
+    def clear(self) -> None:
+        """
+        Destroys all the idle handles held by the pool.
+        """
+        self._idle.clear()
+
+    def close(self) -> None:
+        """
+        Destroys all the idle handles and stops accepting new ones.
+        Called by the Engine before it is finalized.
+        """
+        self._closed = True
+        self.clear()
+
+    @property
+    def hits(self) -> int:
+        """
+        Number of acquisitions served by an idle handle.
+        """
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        """
+        Number of acquisitions that required creating a new handle.
+        """
+        return self._misses
+
+    @property
+    def idle(self) -> int:
+        """
+        Number of idle handles currently held by the pool.
+        """
+        return sum(len(d) for d in self._idle.values())
 
 
 class CallableRemoteFunction:
@@ -150,10 +567,20 @@ class CallableRemoteFunction:
     """
 
     def __init__(self, remote_function: 'RemoteFunction',
-                 handle: _pymargo.Handle, provider_id: int):
+                 handle: _pymargo.Handle, provider_id: int,
+                 address: Optional[Address] = None):
         self._remote_function = remote_function
         self._handle = handle
         self._provider_id = provider_id
+        self._address = address
+
+    def __del__(self) -> None:
+        """
+        Destructor. Gives the handle back to the Engine's HandlePool.
+        """
+        if getattr(self, '_address', None) is not None:
+            self.engine.handle_pool.release(
+                self._address, self.remote_function.rpc_id, self._handle)
 
     @property
     def handle(self) -> _pymargo.Handle:
@@ -171,32 +598,111 @@ class CallableRemoteFunction:
     def provider_id(self) -> int:
         return self._provider_id
 
+    @property
+    def address(self) -> Optional[Address]:
+        return self._address
+
+    def _encode_input(self, mid: margo_instance_id, args: Tuple[Any, ...],
+                      kwargs: Mapping[str, Any]) \
+            -> Tuple[Any, Optional[List[Bulk]]]:
+        """
+        Serializes the arguments of a call. With the pickle codec and
+        an Engine.oob_threshold set, large buffers are sent out-of-band
+        and the returned list holds the Bulk handles exposing them.
+        """
+        codec = self.remote_function.codec
+        threshold = self.engine.oob_threshold
+        if threshold is None or type(codec) is not PickleCodec:
+            return codec.encode_input(mid, args, kwargs), None
+        keepalive: List[Bulk] = []
+        data = _pack_arguments(args, kwargs)
+        raw_data = dumps(mid, data, oob_threshold=threshold,
+                         keepalive=keepalive)
+        return raw_data, keepalive
+
+    def _cache_key(self, raw_data: Any,
+                   keepalive: Any) -> Optional[Hashable]:
+        """
+        Returns the key of a call in the client cache of the
+        RemoteFunction, or None if the call cannot be cached.
+        """
+        # payloads with out-of-band buffers embed Bulk handles,
+        # which differ from one call to the next
+        if self._address is None or keepalive:
+            return None
+        return (str(self._address), self.remote_function.rpc_id,
+                self.provider_id, bytes(raw_data))
+
     def _forward(self, *args: List[Any], timeout: float = 0.0,
                  **kwargs: Mapping[str, Any]) -> Any:
-        data = {
-            'args': args,
-            'kwargs': kwargs
-        }
+        codec = self.remote_function.codec
         mid = self._handle._get_mid()
-        raw_data = dumps(mid, data)
-        raw_response = self.handle._forward(provider_id=self.provider_id,
-                                            input=raw_data, timeout=timeout)
+        raw_data, keepalive = self._encode_input(mid, args, kwargs)
+        cache = self.remote_function._client_cache
+        key = None
+        if cache is not None:
+            self.remote_function._collect_revalidations()
+            key = self._cache_key(raw_data, keepalive)
+            cached = None if key is None else cache.get(key)
+            if cached is not None:
+                return codec.decode_output(mid, cached)
+        try:
+            raw_response = self.handle._forward(
+                provider_id=self.provider_id, input=raw_data,
+                timeout=timeout, as_memoryview=True)
+        except _pymargo.RemoteError as e:
+            raise RemoteException._from_envelope(str(e)) from None
         if raw_response is None:
             return None
-        mid = self._handle._get_mid()
-        return loads(mid, raw_response)  # type: ignore
+        with raw_response:
+            if key is not None:
+                cache.put(key, bytes(raw_response))  # type: ignore
+            return codec.decode_output(mid, raw_response)
 
     def _iforward(self, *args: List[Any], timeout: float = 0.0,
                   **kwargs: Mapping[str, Any]) -> Any:
-        data = {
-            'args': args,
-            'kwargs': kwargs
-        }
         mid = self._handle._get_mid()
-        raw_data = dumps(mid, data)
-        req = self.handle._iforward(provider_id=self.provider_id,
-                                    input=raw_data, timeout=timeout)
-        return ForwardRequest(req, self._handle)
+        raw_data, keepalive = self._encode_input(mid, args, kwargs)
+        remote_function = self.remote_function
+        cache = remote_function._client_cache
+        key = None if cache is None else self._cache_key(raw_data, keepalive)
+        if key is None:
+            return self._iforward_raw(raw_data, timeout, mid, keepalive)
+        remote_function._collect_revalidations()
+        if not remote_function._stale_while_revalidate:
+            cached, fresh = cache.get(key), True  # type: ignore
+        else:
+            cached, fresh = cache.lookup(key)  # type: ignore
+        if cached is None:
+            return self._iforward_raw(raw_data, timeout, mid,
+                                      keepalive, (cache, key))
+        if not fresh and key not in remote_function._revalidations:
+            # serve the stale response, refresh it in the background
+            remote_function._revalidations[key] = self._iforward_raw(
+                raw_data, timeout, mid, keepalive, (cache, key))
+        return CompletedRequest(
+            remote_function.codec.decode_output(mid, cached))
+
+    def _iforward_raw(self, raw_data: Any, timeout: float,
+                      mid: margo_instance_id,
+                      keepalive: Any = None,
+                      cache_entry: Optional[Tuple[LRU, Hashable]] = None) \
+            -> ForwardRequest:
+        if self._address is None:
+            handle = self._handle
+            release = None
+        else:
+            # each non-blocking call uses its own handle so that
+            # several calls to the same target can be in flight
+            rpc_id = self.remote_function.rpc_id
+            pool = self.engine.handle_pool
+            handle = pool.acquire(self._address, rpc_id)
+            release = functools.partial(pool.release, self._address, rpc_id)
+        req = handle._iforward(provider_id=self.provider_id,
+                               input=raw_data, timeout=timeout)
+        return ForwardRequest(req, handle, release, mid,
+                              self.remote_function.codec, keepalive,
+                              cache_entry)
 
     def __call__(self, *args: List[Any], timeout: float = 0.0,
                  blocking=True, **kwargs: Mapping[str, Any]) -> Any:
@@ -205,6 +711,470 @@ class CallableRemoteFunction:
         else:
             return self._iforward(*args, timeout=timeout, **kwargs)
 
+    async def acall(self, *args: List[Any], timeout: float = 0.0,
+                    **kwargs: Mapping[str, Any]) -> Any:
+        """
+        Calls the remote function from a coroutine, without blocking
+        the running asyncio event loop. The Engine must use a progress
+        thread.
+        """
+        self.engine._require_progress_thread()
+        req = self._iforward(*args, timeout=timeout, **kwargs)
+        return await req.async_wait()
+
+    def coalesce(self, max_count: int = 32, max_delay: float = 0.001,
+                 max_size: int = 1024,
+                 timeout: float = 0.0) -> 'Coalescer':
+        """
+        Returns a Coalescer that buffers small calls to this function
+        and sends them as batched RPCs. The server must have registered
+        the function with Engine.register, which unbatches the calls.
+        Only RPCs using the pickle codec can be coalesced.
+        """
+        if type(self.remote_function.codec) is not PickleCodec:
+            raise ValueError('Only RPCs using the pickle codec '
+                             'can be coalesced')
+        return Coalescer(self, max_count=max_count, max_delay=max_delay,
+                         max_size=max_size, timeout=timeout)
+
+
+class CoalescedRequest(Request):
+    """
+    A CoalescedRequest represents a call buffered by a Coalescer.
+    Waiting on or testing it sends the batch it belongs to if this
+    has not been done yet.
+    """
+
+    def __init__(self, batch: '_CoalescedBatch', index: int):
+        super().__init__(None)
+        self._batch = batch
+        self._index = index
+        self._taken = False
+
+    def wait(self):
+        """
+        Wait for the batch to complete and return the output
+        of the call.
+        """
+        self._taken = True
+        output = self._batch.wait()[self._index]
+        if isinstance(output, _FailedCall):
+            raise RemoteException._from_envelope(output.envelope)
+        return output
+
+    def test(self):
+        """
+        Test if the batch of this call has completed,
+        sending it if needed.
+        """
+        return self._batch.test()
+
+    def _pending(self) -> Optional[Request]:
+        return self._batch._pending()
+
+    def _consumed(self) -> bool:
+        return self._taken
+
+    def _complete(self) -> Any:
+        return self.wait()
+
+
+class _CoalescedBatch:
+    """
+    Calls buffered together by a Coalescer, and the
+    ForwardRequest of the batched RPC once it has been sent.
+    """
+
+    def __init__(self, coalescer: 'Coalescer'):
+        self._coalescer = coalescer
+        self._calls: List[bytes] = []
+        self._created = time.monotonic()
+        self._request: Optional[ForwardRequest] = None
+        self._outputs: Optional[List[Any]] = None
+        self._error: Optional[Exception] = None
+        # calls of the batch may be waited on from several threads,
+        # the batched RPC is waited on by the first one only
+        self._lock = threading.Lock()
+
+    def wait(self) -> List[Any]:
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._outputs is None:
+                self._coalescer._flush_batch(self)
+                if self._error is not None:
+                    raise self._error
+                try:
+                    self._outputs = self._request.wait()  # type: ignore
+                except Exception as e:
+                    # every call of the batch fails with the same error
+                    self._error = e
+                    raise
+            return self._outputs  # type: ignore
+
+    def _pending(self) -> Optional[Request]:
+        """
+        Sends the batch if needed. Returns the Request of the batched
+        RPC, or None if its outputs are known.
+        """
+        if self._error is not None or self._outputs is not None:
+            return None
+        self._coalescer._flush_batch(self)
+        if self._error is not None:
+            return None
+        return self._request._pending()  # type: ignore
+
+    def test(self) -> bool:
+        if self._error is not None or self._outputs is not None:
+            return True
+        self._coalescer._flush_batch(self)
+        if self._error is not None:
+            return True
+        return self._request.test()  # type: ignore
+
+
+class Coalescer:
+    """
+    A Coalescer buffers small calls to the same CallableRemoteFunction
+    (hence to the same address and provider id) and ships them as a
+    single batched RPC, once max_count calls are buffered, max_delay
+    seconds after the first call was buffered (on a timer run by the
+    Engine's event loop thread), or when one of the buffered calls is
+    waited on or tested. Calls whose serialized
+    arguments exceed max_size bytes are sent on their own. Calling the
+    Coalescer returns a Request whose wait method returns the output.
+    """
+
+    def __init__(self, callable_remote_function: CallableRemoteFunction,
+                 max_count: int = 32, max_delay: float = 0.001,
+                 max_size: int = 1024, timeout: float = 0.0):
+        self._crf = callable_remote_function
+        self._max_count = max_count
+        self._max_delay = max_delay
+        self._max_size = max_size
+        self._timeout = timeout
+        self._batch: Optional[_CoalescedBatch] = None
+        self._lock = threading.Lock()
+        self._num_batches = 0
+        self._num_batched_calls = 0
+        self._num_direct_calls = 0
+        self._total_flush_latency = 0.0
+        self._max_flush_latency = 0.0
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Request:
+        data = _pack_arguments(args, kwargs)
+        mid = self._crf.engine.mid
+        raw_data = dumps(mid, data)
+        if len(raw_data) > self._max_size:
+            with self._lock:
+                self._num_direct_calls += 1
+            return self._crf._iforward_raw(raw_data, self._timeout, mid)
+        with self._lock:
+            batch = self._batch
+            started = batch is None
+            if started:
+                batch = self._batch = _CoalescedBatch(self)
+            batch._calls.append(raw_data)
+            request = CoalescedRequest(batch, len(batch._calls) - 1)
+            full = len(batch._calls) >= self._max_count
+        if full:
+            self._flush_batch(batch)
+        elif started:
+            loop = self._crf.engine._event_loop().loop
+            loop.call_soon_threadsafe(loop.call_later, self._max_delay,
+                                      self._flush_batch, batch)
+        return request
+
+    def flush(self) -> None:
+        """
+        Sends the buffered calls, if any, as a batched RPC.
+        """
+        self._flush_batch(None)
+
+    def _flush_batch(self, batch: Optional[_CoalescedBatch]) -> None:
+        """
+        Sends the given batch (by default the one being buffered)
+        if this has not been done yet. Called from the timer of the
+        batch as well as from the threads waiting on its calls.
+        """
+        with self._lock:
+            if batch is None:
+                batch = self._batch
+            if batch is None or batch._request is not None \
+               or batch._error is not None:
+                return
+            if self._batch is batch:
+                self._batch = None
+            mid = self._crf.engine.mid
+            try:
+                raw_data = dumps(mid, {'batch': batch._calls})
+                batch._request = self._crf._iforward_raw(
+                    raw_data, self._timeout, mid)
+            except Exception as e:
+                # every call of the batch fails with the same error
+                batch._error = e
+                return
+            latency = time.monotonic() - batch._created
+            self._num_batches += 1
+            self._num_batched_calls += len(batch._calls)
+            self._total_flush_latency += latency
+            self._max_flush_latency = max(self._max_flush_latency, latency)
+
+    @property
+    def batches(self) -> int:
+        """
+        Number of batched RPCs sent.
+        """
+        return self._num_batches
+
+    @property
+    def batched_calls(self) -> int:
+        """
+        Number of calls sent as part of a batch.
+        """
+        return self._num_batched_calls
+
+    @property
+    def direct_calls(self) -> int:
+        """
+        Number of calls too large to be batched.
+        """
+        return self._num_direct_calls
+
+    @property
+    def average_batch_size(self) -> float:
+        """
+        Average number of calls per batched RPC.
+        """
+        if self._num_batches == 0:
+            return 0.0
+        return self._num_batched_calls / self._num_batches
+
+    @property
+    def average_flush_latency(self) -> float:
+        """
+        Average time (in seconds) a batch spent buffered before being sent.
+        """
+        if self._num_batches == 0:
+            return 0.0
+        return self._total_flush_latency / self._num_batches
+
+    @property
+    def max_flush_latency(self) -> float:
+        """
+        Maximum time (in seconds) a batch spent buffered before being sent.
+        """
+        return self._max_flush_latency
+
+
+class _FailedCall:
+    """
+    Output of a call within a batched RPC whose handler
+    raised an exception, holding its error envelope.
+    """
+
+    def __init__(self, envelope: str):
+        self.envelope = envelope
+
+
+class _BatchedHandle:
+    """
+    Stands for the handle of a single call within a batched RPC,
+    capturing the response of the handler instead of sending it.
+    Other attributes are those of the handle of the batched RPC.
+    """
+
+    def __init__(self, handle: _pymargo.Handle):
+        self._handle = handle
+        self._output: Any = None
+
+    def respond(self, data: Any = None,
+                blocking: bool = True) -> Optional[Request]:
+        self._output = data
+        return None if blocking else CompletedRequest()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._handle, name)
+
+
+def _run_batch(func: Callable, handle: _pymargo.Handle,
+               batch: List[bytes], with_traceback: bool) -> None:
+    """
+    Runs each call of a batched RPC and responds with
+    the list of their outputs. Calls whose handler raised
+    get a _FailedCall as output.
+    """
+    mid = handle._get_mid()
+    outputs = []
+    for raw_input_data in batch:
+        batched_handle = _BatchedHandle(handle)
+        try:
+            args, kwargs = _unpack_arguments(loads(mid, raw_input_data))
+            func(batched_handle, *args, **kwargs)
+            outputs.append(batched_handle._output)
+        except Exception as e:
+            outputs.append(_FailedCall(_error_envelope(e, with_traceback)))
+    handle.respond(outputs)
+
+
+async def _arun_batch(func: Callable, handle: _pymargo.Handle,
+                      batch: List[bytes], with_traceback: bool) -> None:
+    """
+    Same as _run_batch for an async def handler. The calls of the
+    batch run concurrently.
+    """
+    mid = handle._get_mid()
+
+    async def run_one(raw_input_data: bytes) -> Any:
+        batched_handle = _BatchedHandle(handle)
+        try:
+            args, kwargs = _unpack_arguments(loads(mid, raw_input_data))
+            await func(batched_handle, *args, **kwargs)
+            return batched_handle._output
+        except Exception as e:
+            return _FailedCall(_error_envelope(e, with_traceback))
+
+    outputs = await asyncio.gather(*[run_one(raw) for raw in batch])
+    handle.respond(list(outputs))
+
+
+async def _run_async_handler(coro: Coroutine[Any, Any, Any],
+                             handle: _pymargo.Handle, rpc_name: str,
+                             with_traceback: bool) -> None:
+    """
+    Runs the coroutine of an async def handler on the Engine's event
+    loop, responding with an error envelope if it raises.
+    """
+    try:
+        await coro
+    except Exception as e:
+        if not _respond_error(handle, e, with_traceback):
+            _pymargo.error(f'RPC {rpc_name} raised {e!r} after responding',
+                           mid=handle._get_mid())
+            return
+        _pymargo.error(f'RPC {rpc_name} failed with {e!r}',
+                       mid=handle._get_mid())
+    finally:
+        _end_flight(handle)
+
+
+class _SingleFlight:
+    """
+    Tracks the requests of a singleflight RPC (see Engine.register)
+    that wait for the response of an identical in-flight request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[Hashable, List[_pymargo.Handle]] = {}
+
+    def join(self, key: Hashable, handle: _pymargo.Handle) \
+            -> Optional[List[_pymargo.Handle]]:
+        """
+        Returns the (empty) list of waiters of a new flight for the key
+        if the handle leads it, None if the handle was added to the
+        waiters of the current one.
+        """
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is None:
+                waiters = self._waiters[key] = []
+                return waiters
+            waiters.append(handle)
+            return None
+
+    def detach(self, key: Hashable,
+               waiters: List[_pymargo.Handle]) -> None:
+        """
+        Ends the flight of the key, if waiters is still its list, so that
+        later requests start a new one. The waiters already in the list
+        remain there.
+        """
+        with self._lock:
+            if self._waiters.get(key) is waiters:
+                del self._waiters[key]
+
+    def take(self, key: Hashable,
+             waiters: List[_pymargo.Handle]) -> List[_pymargo.Handle]:
+        """
+        Ends the flight of the key if needed, and removes the waiters
+        from the list, returning them.
+        """
+        with self._lock:
+            if self._waiters.get(key) is waiters:
+                del self._waiters[key]
+            taken = list(waiters)
+            waiters.clear()
+            return taken
+
+
+def _end_flight(h: _pymargo.Handle) -> None:
+    """
+    Called once the handler of h has returned. If h leads a singleflight
+    and has not responded, ends the flight so that later identical
+    requests do not wait on it. The requests already waiting get the
+    response of h if it is sent later, and are freed along with h if not.
+    """
+    flight = getattr(h, '_pymargo_singleflight', None)
+    if flight is not None:
+        singleflight, key, waiters = flight
+        singleflight.detach(key, waiters)
+
+
+def _respond_to_waiters(h: _pymargo.Handle, raw_data: Any,
+                        error: bool) -> List[Tuple[_pymargo.Handle, Any]]:
+    """
+    If h leads a singleflight, sends its response to the waiting
+    requests with _irespond. Returns the handles and their requests.
+    """
+    flight = getattr(h, '_pymargo_singleflight', None)
+    if flight is None:
+        return []
+    h._pymargo_singleflight = None
+    singleflight, key, waiters = flight
+    requests = []
+    for waiter in singleflight.take(key, waiters):
+        try:
+            requests.append((waiter, waiter._irespond(raw_data,
+                                                      error=error)))
+        except MargoException as e:
+            _pymargo.error(f'Could not respond to a singleflight '
+                           f'request: {e}', mid=waiter._get_mid())
+    return requests
+
+
+def _send_response(h: _pymargo.Handle, raw_data: Any,
+                   error: bool = False) -> None:
+    """
+    Sends a response, and the same response to the requests waiting on
+    h if it leads a singleflight. Handles of async def handlers respond
+    without blocking the event loop, completing in the background.
+    """
+    mid = h._get_mid()
+    waiters = _respond_to_waiters(h, raw_data, error)
+    if getattr(h, '_pymargo_async', False):
+        wait_request_in_background(mid, h._irespond(raw_data, error=error))
+        for _, req in waiters:
+            wait_request_in_background(mid, req)
+        return
+    h._respond(raw_data, error=error)
+    for _, req in waiters:
+        Request(req, mid).wait()
+
+
+def _respond_error(handle: _pymargo.Handle, error: Exception,
+                   with_traceback: bool) -> bool:
+    """
+    Responds to the handle with the error envelope of the exception,
+    unless the handler already responded. Returns whether it did.
+    """
+    if getattr(handle, '_responded', False):
+        return False
+    handle._responded = True
+    envelope = _error_envelope(error, with_traceback)
+    _send_response(handle, envelope.encode(), error=True)
+    return True
+
 
 def __Handle_get_Address(h: _pymargo.Handle) -> Address:
     """
@@ -218,16 +1188,49 @@ def __Handle_get_Address(h: _pymargo.Handle) -> Address:
 def __Handle_respond(h: _pymargo.Handle, data: Any = None,
                      blocking: bool = True) -> Optional[Request]:
     """
-    This function calls h._respond with pickled data.
+    This function calls h._respond with pickled data. In an async def
+    handler, the response is sent without blocking the event loop even
+    if blocking is True. If h leads a singleflight, the Request returned
+    when blocking is False also covers the responses to the waiting
+    requests.
     """
     mid = h._get_mid()
-    raw_data = dumps(mid, data)
+    codec = getattr(h, '_codec', None)
+    if codec is None:
+        raw_data = dumps(mid, data)
+    else:
+        raw_data = codec.encode_output(mid, data)
+    cache_entry = getattr(h, '_pymargo_cache', None)
+    if cache_entry is not None:
+        cache, key = cache_entry
+        raw_data = bytes(raw_data)
+        cache.put(key, raw_data, size=len(key[1]) + len(raw_data))
+    # only marked as responded once sent, so that an output failing to
+    # encode makes the wrapper respond with the error envelope instead
     if blocking:
-        h._respond(raw_data)
+        _send_response(h, raw_data)
+        h._responded = True
         return None
     else:
+        waiters = _respond_to_waiters(h, raw_data, False)
         req = h._irespond(raw_data)
-        return Request(req)
+        h._responded = True
+        if not waiters:
+            return Request(req, mid)
+        if getattr(h, '_pymargo_async', False):
+            for _, waiter_req in waiters:
+                wait_request_in_background(mid, waiter_req)
+            return Request(req, mid)
+        return _ResponseRequest(
+            req, mid, [Request(waiter_req, mid) for _, waiter_req in waiters])
+
+
+async def __Handle_arespond(h: _pymargo.Handle, data: Any = None) -> None:
+    """
+    This function responds with pickled data from a coroutine,
+    without blocking the running asyncio event loop.
+    """
+    await __Handle_respond(h, data, blocking=False).async_wait()
 
 
 """
@@ -238,6 +1241,7 @@ and use the pickle module, respectively
 setattr(_pymargo.Handle, "get_addr", __Handle_get_Address)
 setattr(_pymargo.Handle, "address", property(__Handle_get_Address))
 setattr(_pymargo.Handle, "respond", __Handle_respond)
+setattr(_pymargo.Handle, "arespond", __Handle_arespond)
 
 
 class RemoteFunction:
@@ -246,14 +1250,23 @@ class RemoteFunction:
     enable manipulating it in an object-oriented manner.
     """
 
-    def __init__(self, engine: 'Engine', rpc_id: int):
+    def __init__(self, engine: 'Engine', rpc_id: int,
+                 codec: Union[str, Codec, None] = None):
         self._engine = engine
         self._rpc_id = rpc_id
+        self._codec = get_codec(codec)
+        self._client_cache: Optional[LRU] = None
+        self._stale_while_revalidate = False
+        self._revalidations: Dict[Hashable, ForwardRequest] = {}
 
     @property
     def rpc_id(self) -> int:
         return self._rpc_id
 
+    @property
+    def codec(self) -> Codec:
+        return self._codec
+
     @property
     def engine(self) -> 'Engine':
         return self._engine
@@ -263,9 +1276,68 @@ class RemoteFunction:
         """
         Binds the RemoteFunction to an Address and provider_id,
         returning a CallableRemoteFunction that can be called.
-        """
-        handle = _pymargo.create(self.engine.mid, address.hg_addr, self.rpc_id)
-        return CallableRemoteFunction(self, handle, provider_id)
+        The underlying handle is taken from the Engine's HandlePool.
+        """
+        handle = self.engine.handle_pool.acquire(address, self.rpc_id)
+        return CallableRemoteFunction(self, handle, provider_id, address)
+
+    def broadcast(self, addresses: Sequence[Address], *args: Any,
+                  provider_id: int = 0, timeout: float = 0.0,
+                  **kwargs: Any) -> List[Any]:
+        """
+        Calls the RemoteFunction with the same arguments on all the
+        given addresses. The arguments are serialized only once and all
+        the requests are issued before any of them is waited on.
+        Returns the outputs in the order of the addresses. A target that
+        failed or timed out has the corresponding exception in place of
+        its output.
+        """
+        raw_data = self.codec.encode_input(self.engine.mid, args, kwargs)
+        return self._gather([(address, raw_data) for address in addresses],
+                            provider_id, timeout)
+
+    def scatter(self, addresses: Sequence[Address],
+                per_target_args: Sequence[Sequence[Any]],
+                provider_id: int = 0, timeout: float = 0.0,
+                **kwargs: Any) -> List[Any]:
+        """
+        Calls the RemoteFunction on all the given addresses, each target
+        receiving its own positional arguments from per_target_args and
+        the keyword arguments shared by all. The requests are issued
+        before any of them is waited on. Returns the outputs in the order
+        of the addresses, with exceptions in place of the outputs of
+        targets that failed or timed out.
+        """
+        if len(addresses) != len(per_target_args):
+            raise ValueError(
+                'scatter needs as many argument tuples as addresses')
+        mid = self.engine.mid
+        targets = [(address, self.codec.encode_input(mid, tuple(args), kwargs))
+                   for address, args in zip(addresses, per_target_args)]
+        return self._gather(targets, provider_id, timeout)
+
+    def _gather(self, targets: Sequence[Tuple[Address, Any]],
+                provider_id: int, timeout: float) -> List[Any]:
+        mid = self.engine.mid
+        pool = self.engine.handle_pool
+        results: List[Any] = [None] * len(targets)
+        requests: List[Request] = []
+        indices: List[int] = []
+        for i, (address, raw_data) in enumerate(targets):
+            try:
+                handle = pool.acquire(address, self.rpc_id)
+                req = handle._iforward(provider_id=provider_id,
+                                       input=raw_data, timeout=timeout)
+            except Exception as e:
+                results[i] = e
+                continue
+            release = functools.partial(pool.release, address, self.rpc_id)
+            requests.append(
+                ForwardRequest(req, handle, release, mid, self.codec))
+            indices.append(i)
+        for j, output in Request.wait_all(requests, return_exceptions=True):
+            results[indices[j]] = output
+        return results
 
     def disable_response(self, disable: bool = True) -> None:
         """
@@ -279,11 +1351,95 @@ class RemoteFunction:
         """
         return _pymargo.disabled_response(self.engine.mid, self.rpc_id)
 
+    def enable_client_cache(self, maxsize: int = 128,
+                            ttl: Optional[float] = None,
+                            max_bytes: Optional[int] = None,
+                            stale_while_revalidate: bool = False) -> LRU:
+        """
+        Caches the responses of this RPC on the client side, keyed by
+        address, RPC id, provider id and serialized arguments, so that
+        repeated calls return without going through Mercury. Only
+        suitable for RPCs whose response rarely changes. See LRU for
+        maxsize, ttl and max_bytes. With stale_while_revalidate,
+        non-blocking calls return an expired response right away and
+        refresh it in the background. Returns the LRU, which exposes
+        hit counters and ratio.
+        """
+        self._client_cache = LRU(maxsize, ttl, max_bytes)
+        self._stale_while_revalidate = stale_while_revalidate
+        return self._client_cache
+
+    def disable_client_cache(self) -> None:
+        """
+        Disables the client cache, waiting for pending revalidations.
+        """
+        self._collect_revalidations(wait=True)
+        self._client_cache = None
+
+    @property
+    def client_cache(self) -> Optional[LRU]:
+        return self._client_cache
+
+    def _collect_revalidations(self, wait: bool = False) -> None:
+        """
+        Completes the background refreshes of stale cache entries that
+        have finished (or all of them if wait is True), which stores
+        their response in the cache. Failed refreshes are dropped.
+        """
+        for key, request in list(self._revalidations.items()):
+            if not wait and not request.test():
+                continue
+            del self._revalidations[key]
+            try:
+                request.wait()
+            except Exception:
+                pass
+
+    def invalidate_cache(self, *args: Any, **kwargs: Any) -> int:
+        """
+        Removes from the server-side cache of this RPC (see
+        Engine.register) the response to a call with the given arguments,
+        or all the responses of this RPC if no argument is given.
+        Returns the number of removed responses.
+        """
+        cache = self.engine._rpc_caches.get(self.rpc_id)
+        if cache is None:
+            return 0
+        if not args and not kwargs:
+            rpc_id = self.rpc_id
+            return cache.invalidate_if(lambda key: key[0] == rpc_id)
+        raw_data = self.codec.encode_input(self.engine.mid, args, kwargs)
+        return int(cache.invalidate((self.rpc_id, bytes(raw_data))))
+
     def deregister(self) -> None:
         """
         Deregisters the function from the engine.
         """
         _pymargo.deregister(self.engine.mid, self.rpc_id)
+        self.engine._rpc_pools.pop(self.rpc_id, None)
+        self.engine._rpc_caches.pop(self.rpc_id, None)
+
+
+def _has_progress_thread(config: dict) -> bool:
+    """
+    Returns whether, according to its configuration, a margo instance
+    makes progress in an execution stream other than the primary one.
+    Returns True if the configuration does not tell.
+    """
+    argobots = config.get('argobots', {})
+    pools = argobots.get('pools', [])
+    primary = [x for x in argobots.get('xstreams', [])
+               if x.get('name') == '__primary__']
+    progress_pool = config.get('progress_pool')
+    if not primary or progress_pool is None:
+        return True
+
+    def pool_name(pool: Union[str, int]) -> str:
+        # pools are referred to by name or by index
+        return pool if isinstance(pool, str) else pools[pool]['name']
+    primary_pools = primary[0].get('scheduler', {}).get('pools', [])
+    return pool_name(progress_pool) not in \
+        [pool_name(p) for p in primary_pools]
 
 
 class Engine:
@@ -336,7 +1492,10 @@ class Engine:
                  mode: _pymargo.mode = server,
                  use_progress_thread: bool = False,
                  num_rpc_threads: int = 0,
-                 config: Union[str, dict] = ""):
+                 config: Union[str, dict] = "",
+                 oob_threshold: Optional[int] = None,
+                 eager_bulk_threshold: Optional[int] = None,
+                 remote_tracebacks: bool = True):
         """
         Constructor of the Engine class.
         addr : address of the Engine
@@ -344,6 +1503,14 @@ class Engine:
         use_progress_thread : whether to use a progress execution stream or not
         num_rpc_threads : Number of RPC execution streams
         config : config dictionary (or serialized in json)
+        oob_threshold : size from which buffers in RPC arguments are sent
+                        out-of-band, as Bulk handles (None to disable)
+        eager_bulk_threshold : size up to which read-only Bulk handles
+                               created by create_bulk embed their content
+                               when serialized (None to disable)
+        remote_tracebacks : whether RPC handlers registered by this Engine
+                            send their traceback to the client (as part
+                            of a RemoteException) when they raise
         """
         self._finalized = True
         if isinstance(config, dict):
@@ -355,6 +1522,15 @@ class Engine:
         self._finalized = False
         self._logger = Engine.EngineLogger(self)
         self._owns_mid = True
+        self._handle_pool = HandlePool(self)
+        self._close_handle_pool_on_prefinalize()
+        self._rpc_pools: Dict[int, Dict[str, Any]] = {}
+        self._rpc_caches: Dict[int, LRU] = {}
+        self._loop_thread: Optional[EventLoopThread] = None
+        self._progress_thread: Optional[bool] = None
+        self.oob_threshold = oob_threshold
+        self.eager_bulk_threshold = eager_bulk_threshold
+        self.remote_tracebacks = remote_tracebacks
 
     @classmethod
     def from_margo_instance_id(cls, mid: margo_instance_id) -> 'Engine':
@@ -363,6 +1539,15 @@ class Engine:
         engine._finalized = False
         engine._logger = Engine.EngineLogger(engine)
         engine._owns_mid = False
+        engine._handle_pool = HandlePool(engine)
+        engine._close_handle_pool_on_prefinalize()
+        engine._rpc_pools = {}
+        engine._rpc_caches = {}
+        engine._loop_thread = None
+        engine._progress_thread = None
+        engine.oob_threshold = None
+        engine.eager_bulk_threshold = None
+        engine.remote_tracebacks = True
         return engine
 
     def __del__(self) -> None:
@@ -395,6 +1580,7 @@ class Engine:
         """
         Finalizes the Engine.
         """
+        self._handle_pool.close()
         _pymargo.finalize(self._mid)
         self._finalized = True
 
@@ -405,6 +1591,49 @@ class Engine:
         _pymargo.wait_for_finalize(self._mid)
         self._finalized = True
 
+    def _close_handle_pool_on_prefinalize(self) -> None:
+        """
+        Closes the HandlePool before margo is finalized, however the
+        finalization is triggered (e.g. by a remote shutdown while the
+        Engine is in wait_for_finalize).
+        """
+        # the callback only holds a weak reference to the pool,
+        # which holds the Engine, so as not to keep the Engine alive
+        pool_ref = weakref.ref(self._handle_pool)
+
+        def close_handle_pool():
+            pool = pool_ref()
+            if pool is not None:
+                pool.close()
+        _pymargo.push_prefinalize_callback(self._mid, close_handle_pool)
+
+    def _require_progress_thread(self) -> None:
+        """
+        Raises MargoException if the Engine does not use a progress
+        thread, without which awaiting a margo request from an event
+        loop would deadlock.
+        """
+        if self._progress_thread is None:
+            config = self.config
+            self._progress_thread = config is None \
+                or _has_progress_thread(config)
+        if not self._progress_thread:
+            raise MargoException(
+                "Awaiting margo requests requires an Engine "
+                "created with use_progress_thread=True")
+
+    def _event_loop(self) -> EventLoopThread:
+        """
+        Returns the event loop running the coroutines of async def
+        handlers, starting it if needed. It is stopped before the
+        Engine is finalized.
+        """
+        if self._loop_thread is None:
+            self._loop_thread = EventLoopThread()
+            _pymargo.push_prefinalize_callback(
+                self._mid, self._loop_thread.stop)
+        return self._loop_thread
+
     @property
     def listening(self) -> bool:
         """
@@ -436,14 +1665,46 @@ class Engine:
     def register(self, rpc_name: Optional[str] = None,
                  func: Optional[Callable] = None,
                  provider_id: int = 0,
-                 disable_response: bool = False):
+                 disable_response: bool = False,
+                 codec: Union[str, Codec, None] = None,
+                 pool: Union[str, int, None] = None,
+                 cache: Optional[LRU] = None,
+                 singleflight: bool = False):
         """
         Registers an RPC handle. If the Engine is a client, the function
         and provider_id arguments should be ommited. If the engine is a
         server, function should be a callable object (function or method
         bound to an object. rpc_name is the name of the RPC, to be used
-        by clients when sending requests.
-        """
+        by clients when sending requests. codec is the name of a
+        registered Codec, or a Codec instance, used to serialize the
+        arguments and output of the RPC (pickle by default). It must be
+        the same on the client and server sides. pool is the name or
+        index of the Argobots pool (as defined in the Engine's
+        configuration) in which the handler runs, e.g. to keep slow
+        RPCs from delaying others. None means margo's default pool.
+        If function is an async def function, its coroutines run on an
+        event loop owned by the Engine (which must then use a progress
+        thread), so that suspended requests do not hold a ULT.
+        cache is an LRU in which responses are kept, keyed by the raw
+        input of the request, so that requests identical to a previous
+        one are answered without running the handler. It must only be
+        used with idempotent RPCs, see also RemoteFunction.invalidate_cache.
+        If singleflight is True, requests arriving while an identical
+        request (same raw input) is being handled do not run the handler:
+        they get the response of that request once it is sent. A handler
+        returning without responding ends the flight, later identical
+        requests then run the handler again.
+        """
+        if func is not None and hasattr(func, '_pymargo_info'):
+            info = func._pymargo_info  # type: ignore
+            if codec is None:
+                codec = info.get('codec')
+            if pool is None:
+                pool = info.get('pool')
+            if cache is None:
+                cache = info.get('cache')
+            singleflight = singleflight or info.get('singleflight', False)
+        the_codec = get_codec(codec)
         if func is None:
             if rpc_name is None:
                 raise ValueError(
@@ -465,15 +1726,88 @@ class Engine:
             else:
                 the_rpc_name = str(rpc_name)
 
+            # captured rather than read from self so that the
+            # registered wrapper does not keep the Engine alive
+            with_traceback = self.remote_tracebacks
+            is_async = asyncio.iscoroutinefunction(func)
+            run_batch = _arun_batch if is_async else _run_batch
+            event_loop = self._event_loop() if is_async else None
+            if type(the_codec) is PickleCodec:
+                def run(handle, raw_input_data):
+                    # the sender's address is only needed, hence
+                    # only looked up, for out-of-band buffers
+                    input_data = loads(handle._get_mid(), raw_input_data,
+                                       handle._get_hg_addr)
+                    if type(input_data) is tuple:
+                        return func(handle, *input_data)
+                    if 'batch' in input_data:
+                        return run_batch(func, handle, input_data['batch'],
+                                         with_traceback)
+                    return func(handle, *input_data['args'],
+                                **input_data['kwargs'])
+            else:
+                def run(handle, raw_input_data):
+                    handle._codec = the_codec
+                    args, kwargs = the_codec.decode_input(
+                        handle._get_mid(), raw_input_data)
+                    return func(handle, *args, **kwargs)
+
+            flights = _SingleFlight() if singleflight else None
+
             def wrapper(handle, raw_input_data):
-                mid = handle._get_mid()
-                input_data = loads(mid, raw_input_data)
-                args = input_data['args']
-                kwargs = input_data['kwargs']
-                func(handle, *args, **kwargs)
+                if cache is not None or flights is not None:
+                    key = (handle.get_id(), bytes(raw_input_data))
+                if cache is not None:
+                    cached = cache.get(key)
+                    if cached is not None:
+                        handle._respond(cached)
+                        return
+                    # __Handle_respond stores the response
+                    handle._pymargo_cache = (cache, key)
+                if flights is not None:
+                    waiters = flights.join(key, handle)
+                    if waiters is None:
+                        # responded to by the leader of the flight
+                        return
+                    handle._pymargo_singleflight = (flights, key, waiters)
+                submitted = False
+                try:
+                    result = run(handle, raw_input_data)
+                    if is_async:
+                        # the ULT returns right away, the coroutine
+                        # is suspended on the event loop while waiting
+                        handle._pymargo_async = True
+                        event_loop.submit(_run_async_handler(
+                            result, handle, the_rpc_name, with_traceback))
+                        submitted = True
+                except Exception as e:
+                    # errors raised after the handler responded
+                    # are reported by the native callback
+                    if not _respond_error(handle, e, with_traceback):
+                        raise
+                    _pymargo.error(
+                        f'RPC {the_rpc_name} failed with {e!r}',
+                        mid=handle._get_mid())
+                finally:
+                    # the flight of an async def handler ends
+                    # once its coroutine has completed
+                    if flights is not None and not submitted:
+                        _end_flight(handle)
+            pool_name = None
+            if pool is not None:
+                pool_name, pool = _pymargo.find_pool(self._mid, pool)
             rpc_id = _pymargo.register(
-                self._mid, the_rpc_name, provider_id, wrapper)
-        remote_function = RemoteFunction(self, rpc_id)
+                self._mid, the_rpc_name, provider_id, wrapper,
+                input_as_memoryview=True, pool=pool)
+            if cache is not None:
+                self._rpc_caches[rpc_id] = cache
+            if pool_name is not None:
+                self._rpc_pools[rpc_id] = {
+                    'name': the_rpc_name,
+                    'provider_id': provider_id,
+                    'pool': pool_name
+                }
+        remote_function = RemoteFunction(self, rpc_id, the_codec)
         remote_function.disable_response(disable_response)
         return remote_function
 
@@ -512,12 +1846,14 @@ class Engine:
         return result
 
     def registered(self, rpc_name: str,
-                   provider_id: Optional[int] = None) \
+                   provider_id: Optional[int] = None,
+                   codec: Union[str, Codec, None] = None) \
             -> Optional[RemoteFunction]:
         """
         Checks if an RPC with the given name is registered.
         Returns the corresponding RPC id if found, None otherwise.
         If provider_id is given, the returned RPC id will integrate it.
+        codec is the Codec the returned RemoteFunction should use.
         """
         if provider_id is None:
             rpc_id = _pymargo.registered(self._mid, rpc_name)
@@ -527,7 +1863,7 @@ class Engine:
         if rpc_id is None:
             return None
         else:
-            return RemoteFunction(self, rpc_id)  # type: ignore
+            return RemoteFunction(self, rpc_id, codec)  # type: ignore
 
     def lookup(self, straddr: str) -> Address:
         """
@@ -551,17 +1887,75 @@ class Engine:
         """
         return self.addr()
 
-    def create_bulk(self, array: Any, mode: _pymargo.access) -> Bulk:
+    def create_bulk(self, array: Any, mode: _pymargo.access,
+                    request_eager: Optional[bool] = None) -> Bulk:
         """
         Creates a bulk handle to expose the memory used by the provided array
         (which can be any python type that satisfies the buffer protocol,
-        e.g. a bytearray or a numpy array, for instance).
-        The array's memory must be contiguous.
+        e.g. a bytearray or a numpy array, for instance), or by a list
+        of such arrays. The resulting handle has one segment per array,
+        and non-contiguous (strided) arrays are exposed as several
+        segments, so that no packing copy is needed. Transfers see the
+        segments as a single range of bytes, in order. Read-only arrays
+        that would need more than bulk.max_segments segments are copied
+        into contiguous memory instead (ValueError is raised for writable
+        ones).
         mode must be bulk.read_only, bulk.write_only, or bulk.read_write.
+        request_eager : whether the content of the array should travel
+                        inline when the Bulk is serialized. If None,
+                        read-only arrays of at most eager_bulk_threshold
+                        bytes are sent eagerly.
         Returns a Bulk object.
         """
-        blk = _pymargo.bulk_create(self._mid, array, mode)
-        return Bulk(blk)
+        staged = _staged(array, mode)
+        blk = _pymargo.bulk_create(self._mid, staged, mode)
+        if request_eager is None:
+            threshold = self.eager_bulk_threshold
+            arrays = array if isinstance(array, (list, tuple)) else [array]
+            request_eager = threshold is not None \
+                and mode == _pymargo.access.read_only \
+                and sum(memoryview(a).nbytes for a in arrays) <= threshold
+        bulk = Bulk(blk, request_eager)
+        if staged is not array:
+            # the copy must live as long as the handle exposing it
+            bulk._staging = staged
+        return bulk
+
+    def create_file_bulk(self, path: Union[str, os.PathLike],
+                         offset: int = 0, length: Optional[int] = None,
+                         mode: _pymargo.access = _pymargo.access.read_only,
+                         request_eager: Optional[bool] = None) -> FileBulk:
+        """
+        Creates a bulk handle exposing the region [offset, offset+length)
+        of a file, mapped in memory instead of being read into a Python
+        object. Remote processes can pull from the file (read_only) or
+        push into it (write_only, read_write), in which case the file is
+        created and extended as needed and FileBulk.flush writes the
+        data back.
+        length : size of the region (None to go to the end of the file).
+        request_eager : see create_bulk.
+        Returns a FileBulk object, which unmaps the file when deleted.
+        """
+        blk = FileBulk(self._mid, path, offset, length, mode)
+        if request_eager is None:
+            threshold = self.eager_bulk_threshold
+            request_eager = threshold is not None \
+                and mode == _pymargo.access.read_only \
+                and len(blk.buffer) <= threshold
+        blk.request_eager = request_eager
+        return blk
+
+    def buffer_pool(self, sizes: Union[int, Sequence[int]],
+                    count: int) -> BufferPool:
+        """
+        Allocates count buffers of each of the provided sizes and
+        registers them once as read_write Bulk handles. The returned
+        BufferPool leases them to handlers (see BufferPool.lease),
+        sparing them the creation and release of a Bulk per request.
+        """
+        if isinstance(sizes, int):
+            sizes = [sizes]
+        return BufferPool(self._mid, sizes, count)
 
     def transfer(self, op: _pymargo.xfer, origin_addr: Address,
                  origin_handle: Bulk, origin_offset: int,
@@ -589,7 +1983,69 @@ class Engine:
                 self._mid, op, origin_addr._hg_addr,
                 origin_handle._hg_bulk, origin_offset,
                 local_handle._hg_bulk, local_offset, size)
-            return Request(req)
+            return Request(req, self._mid)
+
+    def transfer_pipelined(self, op: _pymargo.xfer, origin_addr: Address,
+                           origin_handle: Bulk, origin_offset: int,
+                           local_handle: Bulk, local_offset: int,
+                           size: int, chunk_size: int,
+                           max_inflight: int = 4,
+                           on_chunk: Optional[Callable[[int, int], None]]
+                           = None) -> None:
+        """
+        Transfers data between Bulk handles (see transfer for the
+        arguments) as a series of chunk_size transfers, keeping up to
+        max_inflight of them in flight. This lets large transfers use
+        several network channels, and lets the caller process the data
+        while the rest is still moving: on_chunk(offset, length) is
+        called as each chunk completes (in completion order), offset
+        being relative to the start of the transferred range.
+        If a transfer fails, the chunks still in flight are waited for
+        before the error is raised.
+        """
+        if chunk_size <= 0 or max_inflight <= 0:
+            raise ValueError("chunk_size and max_inflight must be positive")
+        chunks = ((offset, min(chunk_size, size - offset))
+                  for offset in range(0, size, chunk_size))
+        inflight: List[Request] = []
+        ranges: List[Tuple[int, int]] = []
+        try:
+            for offset, length in chunks:
+                if len(inflight) == max_inflight:
+                    index, _ = Request.wait_any(inflight)
+                    inflight.pop(index)
+                    done = ranges.pop(index)
+                    if on_chunk is not None:
+                        on_chunk(*done)
+                req = _pymargo.bulk_itransfer(
+                    self._mid, op, origin_addr._hg_addr,
+                    origin_handle._hg_bulk, origin_offset + offset,
+                    local_handle._hg_bulk, local_offset + offset, length)
+                inflight.append(Request(req, self._mid))
+                ranges.append((offset, length))
+            while inflight:
+                index, _ = Request.wait_any(inflight)
+                inflight.pop(index)
+                done = ranges.pop(index)
+                if on_chunk is not None:
+                    on_chunk(*done)
+        finally:
+            if inflight:
+                Request.wait_all(inflight, return_exceptions=True)
+
+    async def atransfer(self, op: _pymargo.xfer, origin_addr: Address,
+                        origin_handle: Bulk, origin_offset: int,
+                        local_handle: Bulk, local_offset: int,
+                        size: int) -> None:
+        """
+        Transfers data between Bulk handles from a coroutine, without
+        blocking the running asyncio event loop (see transfer for the
+        meaning of the arguments). The Engine must use a progress thread.
+        """
+        self._require_progress_thread()
+        req = self.transfer(op, origin_addr, origin_handle, origin_offset,
+                            local_handle, local_offset, size, blocking=False)
+        await req.async_wait()  # type: ignore
 
     def get_internal_mid(self) -> margo_instance_id:
         """
@@ -604,6 +2060,13 @@ class Engine:
         """
         return self._mid
 
+    @property
+    def handle_pool(self) -> HandlePool:
+        """
+        Returns the HandlePool used to reuse RPC handles.
+        """
+        return self._handle_pool
+
     @property
     def logger(self) -> EngineLogger:
         """
@@ -620,23 +2083,39 @@ class Engine:
 
     def sleep(self, delay: float) -> None:
         """
-        Sleep for the specified number of seconds,
+        Sleep for the specified number of milliseconds,
         yielding to other Argobots threads.
         """
         _pymargo.sleep(self._mid, delay)
 
     @property
     def config(self) -> dict:
+        """
+        Returns the Engine's margo configuration.
+        """
         config_str = _pymargo.get_config(self._mid)
         if config_str is None:
             return None
         import json
         return json.loads(config_str)
 
+    @property
+    def rpc_pools(self) -> List[Dict[str, Any]]:
+        """
+        Returns the RPCs registered with a specific pool, as a list of
+        {"name": ..., "provider_id": ..., "pool": ...} dictionaries
+        giving the name of their pool.
+        """
+        return [dict(entry) for entry in self._rpc_pools.values()]
+
 
 def _remote(rpc_name: Optional[str] = None,
             disable_response: Optional[bool] = False,
-            service_name: Optional[str] = None):
+            service_name: Optional[str] = None,
+            codec: Union[str, Codec, None] = None,
+            pool: Union[str, int, None] = None,
+            cache: Optional[LRU] = None,
+            singleflight: bool = False):
     def decorator(func):
         name = rpc_name
         if name is None:
@@ -647,7 +2126,11 @@ def _remote(rpc_name: Optional[str] = None,
         func._pymargo_info = {
             'rpc_name': name,
             'disable_response': disable_response,
-            'service_name': service_name
+            'service_name': service_name,
+            'codec': codec,
+            'pool': pool,
+            'cache': cache,
+            'singleflight': singleflight
         }
         return func
     return decorator
@@ -1,31 +1,299 @@
 # (C) 2022 The University of Chicago
 # See COPYRIGHT in top-level directory.
 
+import _pymargo
 import pickle
-from typing import Any
-from .typing import margo_instance_id
-from .bulk import Bulk
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, \
+    Union
+from .typing import margo_instance_id, hg_addr_t
+from .bulk import Bulk, current_mid, current_addr, read_only, write_only, \
+    pull
 
 
-def loads(mid: margo_instance_id, raw_data: bytes) -> Any:
+"""
+Prefix of payloads in which large buffers have been sent out-of-band,
+i.e. exposed through Bulk handles instead of being copied in the payload.
+Such payloads consist of the prefix followed by a pickled tuple
+(in-band pickle data, [(Bulk, size), ...]).
+"""
+_OOB_PREFIX = b'PYMARGO-OOB:'
+
+
+def _pickle_loads(mid: margo_instance_id, raw_data: Any,
+                  hg_addr: Union[hg_addr_t, Callable[[], hg_addr_t],
+                                 None] = None,
+                  **kwargs: Any) -> Any:
+    """
+    Calls pickle.loads with mid set as the current margo instance,
+    so that Bulk objects can be deserialized, and hg_addr as the
+    current address (see bulk.current_addr).
+    """
+    token = current_mid.set(mid)
+    addr_token = current_addr.set(hg_addr)
+    try:
+        return pickle.loads(raw_data, **kwargs)
+    finally:
+        current_addr.reset(addr_token)
+        current_mid.reset(token)
+
+
+def _pickle_dumps(mid: margo_instance_id, data: Any, **kwargs: Any) -> bytes:
+    """
+    Calls pickle.dumps with mid set as the current margo instance.
+    """
+    token = current_mid.set(mid)
+    try:
+        return pickle.dumps(data, **kwargs)
+    finally:
+        current_mid.reset(token)
+
+
+def _pack_arguments(args: Tuple[Any, ...],
+                    kwargs: Mapping[str, Any]) -> Any:
+    """
+    Returns the object pickled by PickleCodec for the arguments of a
+    call: the args tuple itself when there are no keyword arguments,
+    which lets the server pass them positionally, a dictionary otherwise.
+    """
+    if not kwargs:
+        return tuple(args)
+    return {'args': args, 'kwargs': kwargs}
+
+
+def _unpack_arguments(data: Any) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """
+    Inverse of _pack_arguments.
+    """
+    if type(data) is tuple:
+        return data, {}
+    return data['args'], data['kwargs']
+
+
+def loads(mid: margo_instance_id,
+          raw_data: Union[bytes, memoryview],
+          hg_addr: Union[hg_addr_t, Callable[[], hg_addr_t], None] = None) \
+        -> Any:
     """
     This loads function wraps pickle.loads and sets
-    the current mid in Bulk so that Bulk objects can
-    be properly deserialized.
+    the current mid (see bulk.current_mid) so that Bulk
+    objects can be properly deserialized. raw_data may be any
+    bytes-like object, such as a memoryview over an
+    RPC's input or output, which is then decoded in place.
+    If the data was serialized with out-of-band buffers,
+    hg_addr must be the address of the sender, from which
+    these buffers are pulled into newly allocated memory.
+    hg_addr may also be a function returning this address,
+    called only if the data has out-of-band buffers.
     """
-    Bulk._current_mid = mid
-    result = pickle.loads(raw_data)
-    Bulk._current_mid = None
-    return result
+    if raw_data[:len(_OOB_PREFIX)] == _OOB_PREFIX:
+        if callable(hg_addr):
+            hg_addr = hg_addr()
+        return _loads_out_of_band(
+            mid, memoryview(raw_data)[len(_OOB_PREFIX):], hg_addr)
+    return _pickle_loads(mid, raw_data, hg_addr)
 
 
-def dumps(mid: margo_instance_id, data: Any) -> bytes:
+def dumps(mid: margo_instance_id, data: Any,
+          oob_threshold: Optional[int] = None,
+          keepalive: Optional[List[Bulk]] = None) -> bytes:
     """
     This dumps function wraps pickle.dumps and
-    sets the current mid in Bulk so that Bulk objects
+    sets the current mid so that Bulk objects
     can be properly serialized.
+    If oob_threshold is set, buffers that support pickle protocol 5
+    (bytearray, numpy arrays, pickle.PickleBuffer, etc.) of at least
+    oob_threshold bytes are not copied into the payload but exposed
+    as read-only Bulk handles, pulled by the receiver's loads. These
+    Bulk objects are appended to keepalive, which the caller must keep
+    until the receiver is done deserializing (e.g. until the response
+    of the RPC has arrived).
+    """
+    if oob_threshold is None or pickle.HIGHEST_PROTOCOL < 5:
+        return _pickle_dumps(mid, data)
+    buffers: List[memoryview] = []
+
+    def buffer_callback(buf: Any) -> bool:
+        raw = buf.raw()
+        if raw.nbytes < oob_threshold:  # type: ignore
+            return True
+        buffers.append(raw)
+        return False
+
+    payload = _pickle_dumps(mid, data, protocol=5,
+                            buffer_callback=buffer_callback)
+    if not buffers:
+        return payload
+    segments = []
+    for raw in buffers:
+        bulk = Bulk(_pymargo.bulk_create(mid, raw, read_only))
+        segments.append((bulk, raw.nbytes))
+        if keepalive is not None:
+            keepalive.append(bulk)
+    return _OOB_PREFIX + _pickle_dumps(mid, (payload, segments))
+
+
+def _loads_out_of_band(mid: margo_instance_id, raw_data: memoryview,
+                       hg_addr: Optional[hg_addr_t]) -> Any:
+    """
+    Pulls the out-of-band buffers of a payload serialized by dumps
+    with an oob_threshold, then unpickles the payload with them.
+    """
+    if hg_addr is None:
+        raise RuntimeError(
+            "Could not deserialize out-of-band buffers: "
+            "no address to pull them from")
+    payload, segments = _pickle_loads(mid, raw_data, hg_addr)
+    buffers = []
+    for bulk, size in segments:
+        buf = bytearray(size)
+        local_bulk = _pymargo.bulk_create(mid, buf, write_only)
+        try:
+            _pymargo.bulk_transfer(mid, pull, hg_addr, bulk._hg_bulk, 0,
+                                   local_bulk, 0, size)
+        finally:
+            _pymargo.bulk_free(local_bulk)
+        buffers.append(buf)
+    return _pickle_loads(mid, payload, hg_addr, buffers=buffers)
+
+
+class Codec(ABC):
+    """
+    A Codec defines how the arguments and the output of an RPC
+    are converted to and from the payloads sent through Mercury.
+    Codecs are selected per RPC, either by name (see register_codec)
+    or by passing a Codec instance to @remote or Engine.register.
+    Encoding functions may return any bytes-like object.
+    """
+
+    @abstractmethod
+    def encode_input(self, mid: margo_instance_id,
+                     args: Tuple[Any, ...],
+                     kwargs: Dict[str, Any]) -> Any:
+        pass
+
+    @abstractmethod
+    def decode_input(self, mid: margo_instance_id,
+                     raw_data: Union[bytes, memoryview]) \
+            -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def encode_output(self, mid: margo_instance_id, data: Any) -> Any:
+        pass
+
+    @abstractmethod
+    def decode_output(self, mid: margo_instance_id,
+                      raw_data: Union[bytes, memoryview]) -> Any:
+        pass
+
+
+class PickleCodec(Codec):
+    """
+    Default codec, pickling the positional arguments as a tuple, or
+    the arguments as an {'args': ..., 'kwargs': ...} dictionary if there
+    are keyword arguments, and the output as is. Bulk objects may be
+    passed around. Servers prior to py-margo 0.7.0 only accept the
+    dictionary.
+    """
+
+    def encode_input(self, mid, args, kwargs):
+        return dumps(mid, _pack_arguments(args, kwargs))
+
+    def decode_input(self, mid, raw_data):
+        return _unpack_arguments(loads(mid, raw_data))
+
+    def encode_output(self, mid, data):
+        return dumps(mid, data)
+
+    def decode_output(self, mid, raw_data):
+        return loads(mid, raw_data)
+
+
+class RawCodec(Codec):
+    """
+    Codec for RPCs taking a single bytes-like argument and returning
+    a bytes-like object (or None), sent as is. The handler receives
+    a read-only memoryview over the request's payload.
+    """
+
+    def encode_input(self, mid, args, kwargs):
+        if len(args) != 1 or kwargs:
+            raise TypeError(
+                'RawCodec expects a single bytes-like positional argument')
+        return args[0]
+
+    def decode_input(self, mid, raw_data):
+        return (raw_data,), {}
+
+    def encode_output(self, mid, data):
+        return b'' if data is None else data
+
+    def decode_output(self, mid, raw_data):
+        return bytes(raw_data)
+
+
+class StructCodec(Codec):
+    """
+    Codec for RPCs with a fixed signature, packing positional arguments
+    and the output with the struct module. A single-field output format
+    is returned as a value, a multi-field one as a tuple. If
+    output_format is None, the RPC does not return anything.
+    """
+
+    def __init__(self, input_format: str,
+                 output_format: Optional[str] = None):
+        self._input = struct.Struct(input_format)
+        self._output = None if output_format is None \
+            else struct.Struct(output_format)
+
+    def encode_input(self, mid, args, kwargs):
+        if kwargs:
+            raise TypeError('StructCodec does not support keyword arguments')
+        return self._input.pack(*args)
+
+    def decode_input(self, mid, raw_data):
+        return self._input.unpack_from(raw_data), {}
+
+    def encode_output(self, mid, data):
+        if self._output is None:
+            return b''
+        if isinstance(data, tuple):
+            return self._output.pack(*data)
+        return self._output.pack(data)
+
+    def decode_output(self, mid, raw_data):
+        if self._output is None:
+            return None
+        values = self._output.unpack_from(raw_data)
+        return values[0] if len(values) == 1 else values
+
+
+_codecs: Dict[str, Codec] = {
+    'pickle': PickleCodec(),
+    'raw': RawCodec()
+}
+
+
+def register_codec(name: str, codec: Codec) -> None:
+    """
+    Registers a Codec under the given name so that
+    it can be selected by name by @remote and Engine.register.
+    """
+    _codecs[name] = codec
+
+
+def get_codec(codec: Union[str, Codec, None] = None) -> Codec:
+    """
+    Returns the Codec registered under the given name, or the given
+    Codec itself. If codec is None, returns the default (pickle) Codec.
     """
-    Bulk._current_mid = mid
-    result = pickle.dumps(data)
-    Bulk._current_mid = None
-    return result
+    if codec is None:
+        return _codecs['pickle']
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return _codecs[codec]
+    except KeyError:
+        raise ValueError(f'Unknown codec "{codec}"') from None
@@ -1,8 +1,13 @@
 import unittest
+import tempfile
 import os
-from pymargo.core import Engine
+import pickle
+import threading
+import time
+from pymargo.core import Engine, Request
 import pymargo.bulk
-from pymargo.bulk import Bulk
+from pymargo.bulk import Bulk, RemoteBuffer
+from pymargo.serialization import dumps, loads
 
 
 class Receiver():
@@ -68,6 +73,34 @@ class Receiver():
             blocking=False).wait()
         handle.respond()
 
+    def pull_size(self, handle, bulk, size):
+        local_data = bytearray(size)
+        local_bulk = self.engine.create_bulk(
+            local_data, pymargo.bulk.write_only)
+        self.engine.transfer(pymargo.bulk.pull, handle.address, bulk, 0,
+                             local_bulk, 0, size)
+        handle.respond(bytes(local_data[-8:]))
+
+    def pull_all(self, handle, bulks, size):
+        result = []
+        for bulk in bulks:
+            local_data = bytearray(size)
+            local_bulk = self.engine.create_bulk(
+                local_data, pymargo.bulk.write_only)
+            self.engine.transfer(pymargo.bulk.pull, handle.address, bulk,
+                                 0, local_bulk, 0, size)
+            result.append(bytes(local_data))
+        handle.respond(result)
+
+    def summarize(self, handle, data):
+        handle.respond((type(data).__name__, len(data), bytes(data[-4:])))
+
+    def sparse_read(self, handle, bulk, ranges):
+        buf = RemoteBuffer(bulk, handle.address, block_size=4096,
+                           readahead=1)
+        result = [buf[start:stop] for start, stop in ranges]
+        handle.respond((result, len(buf), buf.bytes_transferred))
+
 
 class TestBulk(unittest.TestCase):
 
@@ -84,6 +117,12 @@ class TestBulk(unittest.TestCase):
             'ipull_from_bulk', cls.receiver.ipull_from_bulk)
         cls.ipush_to_bulk = cls.engine.register(
             'ipush_to_bulk', cls.receiver.ipush_to_bulk)
+        cls.pull_size = cls.engine.register(
+            'pull_size', cls.receiver.pull_size)
+        cls.summarize = cls.engine.register(
+            'summarize', cls.receiver.summarize)
+        cls.sparse_read = cls.engine.register(
+            'sparse_read', cls.receiver.sparse_read)
 
     @classmethod
     def tearDownClass(cls):
@@ -134,6 +173,273 @@ class TestBulk(unittest.TestCase):
         rpc(bulk=bulk, size=len(data))
         self.assertEqual(data, b'This is more bytes data')
 
+    def test_multi_segment_bulk(self):
+        engine = TestBulk.engine
+        rpc = TestBulk.pull_from_bulk.on(engine.address)
+        parts = [b'This is ', b'some bytes', b' data']
+        bulk = engine.create_bulk(parts, pymargo.bulk.read_only)
+        self.assertTrue(rpc(bulk=bulk, size=sum(len(p) for p in parts)))
+        # pulling into several buffers
+        data = b'This is some bytes data'
+        remote_bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+        head, tail = bytearray(5), bytearray(len(data) - 5)
+        local_bulk = engine.create_bulk([head, tail], pymargo.bulk.write_only)
+        engine.transfer(pymargo.bulk.pull, engine.address, remote_bulk, 0,
+                        local_bulk, 0, len(data))
+        self.assertEqual(bytes(head), data[:5])
+        self.assertEqual(bytes(tail), data[5:])
+
+    def test_strided_bulk(self):
+        engine = TestBulk.engine
+        data = bytearray(range(64))
+        # every other byte, exposed as 32 one-byte segments
+        strided = memoryview(data)[::2]
+        remote_bulk = engine.create_bulk(strided, pymargo.bulk.read_only)
+        local_data = bytearray(len(strided))
+        local_bulk = engine.create_bulk(local_data, pymargo.bulk.write_only)
+        engine.transfer(pymargo.bulk.pull, engine.address, remote_bulk, 0,
+                        local_bulk, 0, len(local_data))
+        self.assertEqual(bytes(local_data), bytes(data[::2]))
+
+    def test_strided_bulk_staging(self):
+        engine = TestBulk.engine
+        size = 16 * pymargo.bulk.max_segments
+        data = bytearray(i % 251 for i in range(size))
+        # more one-byte segments than a handle may have: the
+        # content is copied into contiguous memory instead
+        strided = memoryview(data)[::4]
+        remote_bulk = engine.create_bulk(strided, pymargo.bulk.read_only)
+        self.assertEqual(remote_bulk.size, len(strided))
+        local_data = bytearray(len(strided))
+        local_bulk = engine.create_bulk(local_data, pymargo.bulk.write_only)
+        engine.transfer(pymargo.bulk.pull, engine.address, remote_bulk, 0,
+                        local_bulk, 0, len(local_data))
+        self.assertEqual(bytes(local_data), bytes(data[::4]))
+        # writable memory cannot be staged
+        with self.assertRaises(ValueError):
+            engine.create_bulk(strided, pymargo.bulk.write_only)
+
+    def test_file_bulk(self):
+        engine = TestBulk.engine
+        data = b'This is some bytes data'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'data')
+            with open(path, 'wb') as f:
+                f.write(b'header' + data)
+            # the remote side pulls from the mapping, and sees the
+            # FileBulk as a regular Bulk
+            bulk = engine.create_file_bulk(path, offset=6)
+            self.assertEqual(bytes(bulk.buffer), data)
+            rpc = TestBulk.pull_from_bulk.on(engine.address)
+            self.assertTrue(rpc(bulk=bulk, size=len(data)))
+            del bulk
+            # pushing into a region past the end extends the file
+            target = engine.create_file_bulk(
+                path, offset=4096 + 6, length=len(data),
+                mode=pymargo.bulk.write_only)
+            local_bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+            engine.transfer(pymargo.bulk.push, engine.address, target, 0,
+                            local_bulk, 0, len(data))
+            target.flush()
+            del target
+            with open(path, 'rb') as f:
+                f.seek(4096 + 6)
+                self.assertEqual(f.read(), data)
+            with self.assertRaises(ValueError):
+                engine.create_file_bulk(path, offset=8192, length=16)
+            # writable modes create missing files
+            path = os.path.join(tmpdir, 'new')
+            target = engine.create_file_bulk(
+                path, offset=6, length=len(data),
+                mode=pymargo.bulk.read_write)
+            engine.transfer(pymargo.bulk.push, engine.address, target, 0,
+                            local_bulk, 0, len(data))
+            target.flush()
+            del target
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), bytes(6) + data)
+
+    def test_transfer_pipelined(self):
+        engine = TestBulk.engine
+        data = bytes(range(256)) * 1000
+        local_data = bytearray(len(data))
+        remote_bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+        local_bulk = engine.create_bulk(local_data, pymargo.bulk.write_only)
+        chunks = []
+
+        def on_chunk(offset, length):
+            self.assertEqual(local_data[offset:offset+length],
+                             data[offset:offset+length])
+            chunks.append((offset, length))
+
+        engine.transfer_pipelined(pymargo.bulk.pull, engine.address,
+                                  remote_bulk, 0, local_bulk, 0, len(data),
+                                  chunk_size=10000, max_inflight=3,
+                                  on_chunk=on_chunk)
+        self.assertEqual(bytes(local_data), data)
+        self.assertEqual(sorted(chunks),
+                         [(o, min(10000, len(data) - o))
+                          for o in range(0, len(data), 10000)])
+
+    def test_remote_buffer(self):
+        engine = TestBulk.engine
+        rpc = TestBulk.sparse_read.on(engine.address)
+        data = bytes(i % 251 for i in range(1024 * 1024))
+        bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+        ranges = [(10, 20), (4000, 4200), (500000, 500100), (-8, None)]
+        result, size, transferred = rpc(bulk, ranges)
+        self.assertEqual(size, len(data))
+        self.assertEqual(result,
+                         [data[start:stop] for start, stop in ranges])
+        # only the touched blocks and their readahead are pulled
+        self.assertLessEqual(transferred, 6 * 4096)
+
+    def test_buffer_pool(self):
+        engine = TestBulk.engine
+        pool = engine.buffer_pool(sizes=[64, 4096], count=2)
+        self.assertEqual(pool.capacity, 4)
+        data = b'This is some bytes data'
+        remote_bulk = engine.create_bulk(data, pymargo.bulk.read_only)
+        with pool.lease(len(data)) as (view, local_bulk):
+            self.assertEqual(len(view), len(data))
+            self.assertEqual(pool.in_use, 1)
+            engine.transfer(pymargo.bulk.pull, engine.address, remote_bulk,
+                            0, local_bulk, 0, len(data))
+            self.assertEqual(bytes(view), data)
+        self.assertEqual(pool.in_use, 0)
+        # small requests overflow to the larger size class
+        leases = [pool.acquire(16) for _ in range(4)]
+        self.assertEqual(pool.occupancy, 1.0)
+        with self.assertRaises(TimeoutError):
+            pool.acquire(16, timeout=0.05)
+        self.assertEqual(pool.waits, 1)
+        self.assertGreater(pool.max_wait_time, 0.0)
+        # a release wakes up a blocked acquire
+        view, bulk = leases.pop()
+        waiter = threading.Thread(
+            target=lambda: leases.append(pool.acquire(16, timeout=5.0)))
+        waiter.start()
+        time.sleep(0.05)
+        pool.release(view, bulk)
+        waiter.join()
+        self.assertEqual(len(leases), 4)
+        self.assertEqual(pool.waits, 2)
+        # a buffer still exported cannot go back to the pool
+        view, bulk = leases[0]
+        exported = pickle.PickleBuffer(view)
+        with self.assertRaises(BufferError):
+            pool.release(view, bulk)
+        self.assertEqual(pool.in_use, 4)
+        exported.release()
+        for view, bulk in leases:
+            pool.release(view, bulk)
+        self.assertEqual(pool.in_use, 0)
+        self.assertEqual(pool.acquisitions, 6)
+        with self.assertRaises(ValueError):
+            pool.acquire(8192)
+
+    def test_eager_bulk(self):
+        engine = TestBulk.engine
+        rpc = TestBulk.pull_from_bulk.on(engine.address)
+        data = b'This is some bytes data'
+        bulk = engine.create_bulk(data, pymargo.bulk.read_only,
+                                  request_eager=True)
+        self.assertTrue(bulk.request_eager)
+        self.assertTrue(rpc(bulk=bulk, size=len(data)))
+        engine.eager_bulk_threshold = 64
+        try:
+            small = engine.create_bulk(data, pymargo.bulk.read_only)
+            large = engine.create_bulk(bytes(128), pymargo.bulk.read_only)
+            writable = engine.create_bulk(bytearray(data),
+                                          pymargo.bulk.read_write)
+        finally:
+            engine.eager_bulk_threshold = None
+        self.assertTrue(small.request_eager)
+        self.assertFalse(large.request_eager)
+        self.assertFalse(writable.request_eager)
+
+    def test_eager_bulk_content(self):
+        engine = TestBulk.engine
+        rpc = TestBulk.pull_size.on(engine.address)
+        for size in [64, 512, 4096]:
+            data = bytes(i % 251 for i in range(size))
+            regular = engine.create_bulk(data, pymargo.bulk.read_only,
+                                         request_eager=False)
+            eager = engine.create_bulk(data, pymargo.bulk.read_only,
+                                       request_eager=True)
+            # only the eager handle carries the content
+            self.assertNotIn(data, regular.__getstate__())
+            self.assertIn(data, eager.__getstate__())
+            self.assertEqual(rpc(regular, size), data[-8:])
+            self.assertEqual(rpc(eager, size), data[-8:])
+
+    def test_out_of_band_dumps(self):
+        engine = TestBulk.engine
+        mid = engine.get_internal_mid()
+        small = bytearray(16)
+        large = bytearray(b'x' * 4096)
+        keepalive = []
+        raw = dumps(mid, small, oob_threshold=1024, keepalive=keepalive)
+        self.assertEqual(len(keepalive), 0)
+        self.assertEqual(loads(mid, raw), small)
+        raw = dumps(mid, [small, large], oob_threshold=1024,
+                    keepalive=keepalive)
+        self.assertEqual(len(keepalive), 1)
+        self.assertLess(len(raw), len(large))
+        result = loads(mid, raw, engine.address._hg_addr)
+        self.assertEqual(result, [small, large])
+
+    def test_out_of_band_rpc(self):
+        engine = TestBulk.engine
+        rpc = TestBulk.summarize.on(engine.address)
+        data = bytearray(b'abcd' * 16384)
+        engine.oob_threshold = 1024
+        try:
+            resp = rpc(data)
+        finally:
+            engine.oob_threshold = None
+        self.assertEqual(resp, ('bytearray', len(data), b'abcd'))
+
+
+class TestBulkConcurrency(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        protocol = os.environ.get('MARGO_PROTOCOL', 'na+sm')
+        cls.engines = [Engine(protocol, use_progress_thread=True,
+                              num_rpc_threads=4) for i in range(2)]
+        cls.rpcs = []
+        for engine in cls.engines:
+            receiver = Receiver(engine)
+            cls.rpcs.append(engine.register('pull_all', receiver.pull_all))
+
+    @classmethod
+    def tearDownClass(cls):
+        for engine in cls.engines:
+            engine.finalize()
+
+    def test_concurrent_bulk_deserialization(self):
+        num_requests = 64
+        requests = []
+        buffers = []
+        engines = TestBulkConcurrency.engines
+        # the address of each engine, as looked up by the other one
+        targets = [engines[0].lookup(str(engines[1].address)),
+                   engines[1].lookup(str(engines[0].address))]
+        for i in range(num_requests):
+            # each engine sends to the other, so both decode Bulk
+            # objects in their rpc threads at the same time
+            source = engines[i % 2]
+            rpc = TestBulkConcurrency.rpcs[i % 2].on(targets[i % 2])
+            data = [bytes([(i + j) % 256]) * 1024 for j in range(8)]
+            bulks = [source.create_bulk(d, pymargo.bulk.read_only)
+                     for d in data]
+            buffers.append((data, bulks))
+            requests.append(rpc(bulks, 1024, blocking=False))
+        results = Request.wait_all(requests)
+        for index, output in results:
+            self.assertEqual(output, buffers[index][0])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,10 +32,10 @@ pymargo_module = Extension('_pymargo', files,
         depends=[])
 
 setup(name='margo',
-      version='0.6.2',
+      version='0.7.0',
       author='Matthieu Dorier',
       description="""Python binding for Margo""",
       ext_modules=[ pymargo_module ],
       packages=find_namespace_packages(include=['mochi.*']) + ['pymargo'],
-      python_requires='>=3.6',
+      python_requires='>=3.7',
 )